@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 
+from . import wecom_http_pool
+from . import wecom_token_cache
+from . import wecom_rate_limiter
+from . import wecom_executor
 from . import wecom_abstract_api
 from . import wecom_server_api
 from . import wecom_message_api
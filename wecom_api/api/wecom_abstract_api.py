@@ -1,11 +1,32 @@
 # -*- coding: utf-8 -*-
 
 import json
-import requests
+import time
 from odoo import api, fields, models, _, SUPERUSER_ID
 from odoo.exceptions import UserError
 import warnings
 
+from .wecom_http_pool import (
+    get_session,
+    DEFAULT_POOL_MAXSIZE,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_READ_TIMEOUT,
+)
+from .wecom_executor import (
+    corp_semaphore,
+    execute_requests,
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_CORP_MAX_CONCURRENCY,
+)
+from .wecom_rate_limiter import (
+    wait_for_rate_limit,
+    is_frequency_limited,
+    backoff_delay,
+    DEFAULT_LIMIT_RETRIES,
+    DEFAULT_BACKOFF_BASE,
+    DEFAULT_BACKOFF_MAX,
+)
+
 
 class ApiException(Exception):
     def __init__(self, errCode, errMsg):
@@ -28,6 +49,40 @@ class WecomAbstractApi(models.AbstractModel):
         ir_config = self.env["ir.config_parameter"].sudo()
         return True if ir_config.get_param("wecom.debug_enabled") == "True" else False
 
+    def get_http_options(self):
+        """
+        获取 HTTP 连接池大小和超时参数
+        :returns (连接池大小, (连接超时, 读取超时))
+        """
+        ir_config = self.env["ir.config_parameter"].sudo()
+        pool_maxsize = int(
+            ir_config.get_param("wecom.api_pool_maxsize", DEFAULT_POOL_MAXSIZE)
+        )
+        connect_timeout = float(
+            ir_config.get_param("wecom.api_connect_timeout", DEFAULT_CONNECT_TIMEOUT)
+        )
+        read_timeout = float(
+            ir_config.get_param("wecom.api_read_timeout", DEFAULT_READ_TIMEOUT)
+        )
+        return pool_maxsize, (connect_timeout, read_timeout)
+
+    def get_rate_limit_options(self):
+        """
+        获取调用频率超过限制时的重试参数
+        :returns (最大重试次数, 退避基数秒, 退避上限秒)
+        """
+        ir_config = self.env["ir.config_parameter"].sudo()
+        limit_retries = int(
+            ir_config.get_param("wecom.api_limit_retries", DEFAULT_LIMIT_RETRIES)
+        )
+        backoff_base = float(
+            ir_config.get_param("wecom.api_backoff_base", DEFAULT_BACKOFF_BASE)
+        )
+        backoff_max = float(
+            ir_config.get_param("wecom.api_backoff_max", DEFAULT_BACKOFF_MAX)
+        )
+        return limit_retries, backoff_base, backoff_max
+
     def getAccessToken(self):
         raise NotImplementedError
 
@@ -56,15 +111,21 @@ class WecomAbstractApi(models.AbstractModel):
         """
         shortUrl = urlType[0]
         method = urlType[1]
+        rate_limit_key = self.__rateLimitKey(urlType)
+        limit_retries, backoff_base, backoff_max = self.get_rate_limit_options()
         response = {}
-        for retryCnt in range(0, 3):
+        tokenRetryCnt = 0
+        limitRetryCnt = 0
+        while True:
+            wait_for_rate_limit(*rate_limit_key)
             try:
                 if "POST" == method:
                     url = self.__makeUrl(shortUrl)
-                    if "agentid" in args and include_agentid:
-                        url = self.__appendArgs(url, {"agentid": args["agentid"]})
-                        del args["agentid"]
-                    response = self.__httpPost(url, args)
+                    params = dict(args) if args else args
+                    if params and "agentid" in params and include_agentid:
+                        url = self.__appendArgs(url, {"agentid": params["agentid"]})
+                        del params["agentid"]
+                    response = self.__httpPost(url, params)
                 elif "GET" == method:
                     url = self.__makeUrl(shortUrl)
                     url = self.__appendArgs(url, args)
@@ -75,28 +136,168 @@ class WecomAbstractApi(models.AbstractModel):
                 raise ApiException(-2, e)  # 其他错误
 
             # 检查令牌是否过期
-            if self.__tokenExpired(response.get("errcode")):
+            if self.__tokenExpired(response.get("errcode")) and tokenRetryCnt < 2:
                 self.__refreshToken(shortUrl)
-                retryCnt += 1
-                continue
+                tokenRetryCnt += 1
+            # 调用频率超过限制，退避后重试
+            elif (
+                is_frequency_limited(response.get("errcode"))
+                and limitRetryCnt < limit_retries
+            ):
+                time.sleep(backoff_delay(limitRetryCnt, backoff_base, backoff_max))
+                limitRetryCnt += 1
             else:
                 break
         # 检测响应
         return self.__checkResponse(response)
 
+    def httpCallBatch(self, calls, max_workers=None):
+        """
+        并发调用API，令牌过期时统一刷新一次后重试过期的请求
+        :param calls : [(urlType, args), ...] 或 [(urlType, args, include_agentid), ...]
+        :param max_workers : 最大并发数，默认取参数 "wecom.api_max_workers"
+        :returns 结果列表，顺序与 calls 一致，成功为响应，失败为 ApiException 实例
+        """
+        ir_config = self.env["ir.config_parameter"].sudo()
+        if max_workers is None:
+            max_workers = int(
+                ir_config.get_param("wecom.api_max_workers", DEFAULT_MAX_WORKERS)
+            )
+        semaphore = corp_semaphore(
+            self["corpid"] if "corpid" in self._fields else None,
+            int(
+                ir_config.get_param(
+                    "wecom.api_corp_max_concurrency", DEFAULT_CORP_MAX_CONCURRENCY
+                )
+            ),
+        )
+        pool_maxsize, timeout = self.get_http_options()
+        limit_retries, backoff_base, backoff_max = self.get_rate_limit_options()
+
+        results = [None] * len(calls)
+        pending = list(range(len(calls)))
+        tokenRetryCnt = 0
+        limitRetryCnt = 0
+        while pending:
+            requests = []
+            for index in pending:
+                try:
+                    requests.append(self.__prepareRequest(*calls[index]))
+                except ApiException as e:
+                    requests.append(e)
+            sendable = [
+                (index, request)
+                for index, request in zip(pending, requests)
+                if not isinstance(request, Exception)
+            ]
+            responses = execute_requests(
+                [request for index, request in sendable],
+                max_workers,
+                semaphore,
+                rate_limits=[
+                    self.__rateLimitKey(calls[index][0]) for index, request in sendable
+                ],
+                timeout=timeout,
+                pool_maxsize=pool_maxsize,
+            )
+            responses.reverse()
+
+            expired = []
+            limited = []
+            for index, request in zip(pending, requests):
+                response = request if isinstance(request, Exception) else responses.pop()
+                if isinstance(response, ApiException):
+                    results[index] = response
+                elif isinstance(response, Exception):
+                    results[index] = ApiException(-2, response)  # 其他错误
+                else:
+                    results[index] = response
+                    if self.__tokenExpired(response.get("errcode")):
+                        expired.append(index)
+                    elif is_frequency_limited(response.get("errcode")):
+                        limited.append(index)
+
+            if expired and tokenRetryCnt < 2:
+                # 检查令牌是否过期，所有请求共用一次刷新
+                self.__refreshToken(calls[expired[0]][0][0])
+                tokenRetryCnt += 1
+            else:
+                expired = []
+            if limited and limitRetryCnt < limit_retries:
+                # 调用频率超过限制，退避后重试
+                time.sleep(backoff_delay(limitRetryCnt, backoff_base, backoff_max))
+                limitRetryCnt += 1
+            else:
+                limited = []
+            pending = sorted(expired + limited)
+
+        for index, response in enumerate(results):
+            if isinstance(response, ApiException):
+                continue
+            try:
+                results[index] = self.__checkResponse(response)
+            except ApiException as e:
+                results[index] = e
+        return results
+
+    def __rateLimitKey(self, urlType):
+        """
+        限流键 (企业ID, API函数名, 每分钟调用次数上限)
+        urlType 由 get_server_api_call 生成时包含API函数名和调用次数上限
+        """
+        corpid = self["corpid"] if "corpid" in self._fields else None
+        if len(urlType) > 3:
+            return corpid, urlType[2], urlType[3]
+        return corpid, urlType[0], 0
+
+    def __prepareRequest(self, urlType, args=None, include_agentid=False):
+        """
+        生成请求，返回 (请求方式, 带令牌的URL, 请求体)
+        """
+        shortUrl = urlType[0]
+        method = urlType[1]
+        args = dict(args) if args else args
+        url = self.__makeUrl(shortUrl)
+        if "POST" == method:
+            if args and "agentid" in args and include_agentid:
+                url = self.__appendArgs(url, {"agentid": args["agentid"]})
+                del args["agentid"]
+            realUrl = self.__appendToken(url)
+            if self.get_api_debug() is True:
+                print("Wecom API POST", realUrl, args)
+            return method, realUrl, json.dumps(args, ensure_ascii=False).encode("utf-8")
+        elif "GET" == method:
+            realUrl = self.__appendToken(self.__appendArgs(url, args))
+            if self.get_api_debug() is True:
+                print("Wecom API GET", realUrl)
+            return method, realUrl, None
+        else:
+            raise ApiException(-1, _("unknown method type"))
+
     def httpPostFile(self, urlType, args=None, data=None, headers=None):
         shortUrl = urlType[0]
+        rate_limit_key = self.__rateLimitKey(urlType)
+        limit_retries, backoff_base, backoff_max = self.get_rate_limit_options()
         response = {}
-        for retryCnt in range(0, 3):
+        tokenRetryCnt = 0
+        limitRetryCnt = 0
+        while True:
+            wait_for_rate_limit(*rate_limit_key)
             url = self.__makeUrl(shortUrl)
             url = self.__appendArgs(url, args)
             response = self.__httpPostFile(url, data, headers)
 
             # 检查令牌是否过期
-            if self.__tokenExpired(response.get("errcode")):
+            if self.__tokenExpired(response.get("errcode")) and tokenRetryCnt < 2:
                 self.__refreshToken(shortUrl)
-                retryCnt += 1
-                continue
+                tokenRetryCnt += 1
+            # 调用频率超过限制，退避后重试
+            elif (
+                is_frequency_limited(response.get("errcode"))
+                and limitRetryCnt < limit_retries
+            ):
+                time.sleep(backoff_delay(limitRetryCnt, backoff_base, backoff_max))
+                limitRetryCnt += 1
             else:
                 break
         return self.__checkResponse(response)
@@ -137,9 +338,16 @@ class WecomAbstractApi(models.AbstractModel):
         if self.get_api_debug() is True:
             print("Wecom API POST", realUrl, args)
 
-        return requests.post(
-            realUrl, data=json.dumps(args, ensure_ascii=False).encode("utf-8")
-        ).json()
+        pool_maxsize, timeout = self.get_http_options()
+        return (
+            get_session(realUrl, pool_maxsize)
+            .post(
+                realUrl,
+                data=json.dumps(args, ensure_ascii=False).encode("utf-8"),
+                timeout=timeout,
+            )
+            .json()
+        )
 
     def __httpPostFile(self, url, data, headers):
         realUrl = self.__appendToken(url)
@@ -147,13 +355,22 @@ class WecomAbstractApi(models.AbstractModel):
         if self.get_api_debug() is True:
             print("Wecom API POST FILE", realUrl, data, headers)
 
-        # response = requests.post(url=realUrl, data=data, headers=headers).json()
-        return requests.post(url=realUrl, data=data, headers=headers).json()
+        pool_maxsize, timeout = self.get_http_options()
+        return (
+            get_session(realUrl, pool_maxsize)
+            .post(url=realUrl, data=data, headers=headers, timeout=timeout)
+            .json()
+        )
 
     def __post_file(self, url, media_file):
         if self.get_api_debug() is True:
             print("Wecom API POST FILE", url, media_file)
-        return requests.post(url, file=media_file).json()
+        pool_maxsize, timeout = self.get_http_options()
+        return (
+            get_session(url, pool_maxsize)
+            .post(url, files=media_file, timeout=timeout)
+            .json()
+        )
 
     def __httpGet(self, url):
         realUrl = self.__appendToken(url)
@@ -161,7 +378,8 @@ class WecomAbstractApi(models.AbstractModel):
         if self.get_api_debug() is True:
             print("Wecom API GET", realUrl)
 
-        return requests.get(realUrl).json()
+        pool_maxsize, timeout = self.get_http_options()
+        return get_session(realUrl, pool_maxsize).get(realUrl, timeout=timeout).json()
 
     @staticmethod
     def __checkResponse(response):
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .wecom_http_pool import get_session
+from .wecom_rate_limiter import wait_for_rate_limit
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_CORP_MAX_CONCURRENCY = 16
+
+# 每个企业同一时间在途的请求数上限，进程内所有批次共享
+_corp_semaphores = {}
+_corp_semaphores_lock = threading.Lock()
+
+
+def corp_semaphore(corpid, size=DEFAULT_CORP_MAX_CONCURRENCY):
+    """
+    获取企业的并发信号量
+    :param corpid: 企业ID
+    :param size: 最大并发数
+    :returns threading.BoundedSemaphore
+    """
+    key = (corpid, size)
+    semaphore = _corp_semaphores.get(key)
+    if semaphore is None:
+        with _corp_semaphores_lock:
+            semaphore = _corp_semaphores.setdefault(
+                key, threading.BoundedSemaphore(size)
+            )
+    return semaphore
+
+
+def send_request(method, url, body=None, headers=None, timeout=None, pool_maxsize=10):
+    """
+    发送请求，只做网络IO，不访问 Odoo 环境，可以在线程中执行
+    :returns 响应的json
+    """
+    session = get_session(url, pool_maxsize)
+    if method == "POST":
+        return session.post(url, data=body, headers=headers, timeout=timeout).json()
+    return session.get(url, timeout=timeout).json()
+
+
+def execute_requests(requests, max_workers, semaphore=None, rate_limits=None, **kwargs):
+    """
+    并发执行请求，结果顺序与 requests 一致
+    :param requests: [(method, url, body), ...]
+    :param max_workers: 最大线程数
+    :param semaphore: 企业并发信号量
+    :param rate_limits: 与 requests 一一对应的限流键 [(corpid, function_name, rate_limit), ...]
+    :param kwargs: 传递给 send_request 的参数
+    :returns 结果列表，成功为响应的json，失败为异常实例
+    """
+    if rate_limits is None:
+        rate_limits = [(None, None, 0)] * len(requests)
+
+    def run(request, rate_limit_key):
+        try:
+            wait_for_rate_limit(*rate_limit_key)
+            if semaphore is None:
+                return send_request(*request, **kwargs)
+            with semaphore:
+                return send_request(*request, **kwargs)
+        except Exception as e:
+            return e
+
+    if max_workers <= 1 or len(requests) <= 1:
+        return [run(*job) for job in zip(requests, rate_limits)]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(requests))) as executor:
+        return list(executor.map(run, requests, rate_limits))
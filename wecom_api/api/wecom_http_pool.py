@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 每个工作进程、每个主机一个 requests.Session，复用 keep-alive 连接，避免每次调用都重新进行 TCP+TLS 握手
+# 键为 (进程ID, 主机, 连接池大小)，进程ID 用于避免 prefork 模式下子进程共用父进程的套接字
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+
+
+def get_session(url, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+    """
+    获取指定URL所在主机的连接池会话
+    :param url: 请求地址
+    :param pool_maxsize: 连接池大小
+    :returns requests.Session
+    """
+    key = (os.getpid(), urlsplit(url).netloc, pool_maxsize)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _sessions[key] = session
+    return session
+
+
+def close_sessions():
+    """
+    关闭当前进程的所有连接池会话
+    """
+    pid = os.getpid()
+    with _sessions_lock:
+        for key in [key for key in _sessions if key[0] == pid]:
+            _sessions.pop(key).close()
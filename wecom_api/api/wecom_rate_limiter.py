@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+import time
+
+# 接口调用频率超过限制的错误码
+# 45009: 接口调用超过限制; 45011: API调用太频繁; 45033: 接口并发调用超过限制
+FREQUENCY_LIMIT_ERRCODES = (45009, 45011, 45033)
+
+DEFAULT_LIMIT_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_MAX = 60.0
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+class TokenBucket(object):
+    """
+    令牌桶，按固定速率补充令牌，桶容量为一秒的额度
+    """
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        获取一个令牌，令牌不足时阻塞等待
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.timestamp) * self.rate
+                )
+                self.timestamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def wait_for_rate_limit(corpid, function_name, rate_limit):
+    """
+    按 (企业ID, API函数名) 限流
+    :param rate_limit: 每分钟调用次数上限，0 表示不限制
+    """
+    if not rate_limit:
+        return
+    key = (corpid, function_name, rate_limit)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.setdefault(key, TokenBucket(rate_limit))
+    bucket.acquire()
+
+
+def is_frequency_limited(errCode):
+    """
+    检查是否为调用频率超过限制
+    """
+    return errCode in FREQUENCY_LIMIT_ERRCODES
+
+
+def backoff_delay(retryCnt, base=DEFAULT_BACKOFF_BASE, cap=DEFAULT_BACKOFF_MAX):
+    """
+    指数退避加随机抖动
+    :param retryCnt: 已重试次数
+    :returns 等待秒数
+    """
+    delay = min(cap, base * 2 ** retryCnt)
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
-import json
-import requests
-from datetime import datetime, timedelta
+import os
+import time
+import tempfile
+from datetime import datetime
 from odoo import api, fields, models, SUPERUSER_ID, _
 
+from .wecom_token_cache import token_cache, FileTokenStore, EXPIRY_MARGIN
+
 # from .wecom_abstract_api import ApiException
 
 
@@ -23,51 +26,129 @@ class WecomServerApi(models.TransientModel):
     def InitServiceApi(self, corpid, secret):
         """
         初始化企业微信API 对象
+        令牌从进程级缓存中获取，缓存命中时不执行任何SQL
         :param corpid : 企业ID
         :param secret : 应用密钥
-        :returns 模型"wecom.service_api"对象
-        """
-        api = self.search([("corpid", "=", corpid), ("secret", "=", secret),], limit=1,)
-        if not api:
-            # 创建API令牌记录
-            api = self.sudo().create({"corpid": corpid, "secret": secret,})
-        if api["access_token"] is False or api["access_token"] == "":
-            # token为空，刷新API令牌记录
-            api.refreshAccessToken()
-        if api["expiration_time"] is False or api["expiration_time"] < datetime.now():
-            # token过期，刷新API令牌记录
-            api.refreshAccessToken()
-
+        :returns 模型"wecom.service_api"对象（内存记录）
+        """
+        api = self.new({"corpid": corpid, "secret": secret})
+        api.getAccessToken()
         return api
 
     def getAccessToken(self):
         """
         获取令牌
         """
-        if self.access_token is None:
-            self.refreshAccessToken()
-        return self.access_token
+        token = token_cache.get_or_refresh(
+            (self.corpid, self.secret), self._load_access_token
+        )
+        self.access_token = token
+        return token
 
     def refreshAccessToken(self):
         """
-        刷新模型 'wecom.service_api' 的令牌
-        同时刷新发起请求的模型 'wecom.apps' 的令牌
+        作废当前令牌并重新获取
+        """
+        stale_token = self.access_token
+        token_cache.invalidate((self.corpid, self.secret), stale_token)
+        token = token_cache.get_or_refresh(
+            (self.corpid, self.secret),
+            lambda: self._load_access_token(stale_token=stale_token),
+        )
+        self.access_token = token
+        return token
+
+    def _load_access_token(self, stale_token=None):
+        """
+        根据参数 "wecom.api_token_store" 从共享存储中获取令牌，共享存储中不存在时请求新令牌
+        memory: 仅进程内缓存
+        file: 本地文件，文件锁保证同一时间只有一个进程请求新令牌
+        database: 表 wecom_apps，Postgres advisory lock 保证同一时间只有一个进程请求新令牌
+        :param stale_token : 已失效的令牌
+        :returns (令牌, 过期时间戳)
+        """
+        ir_config = self.env["ir.config_parameter"].sudo()
+        store = ir_config.get_param("wecom.api_token_store", "memory")
+        if store == "database":
+            return self._load_access_token_from_database(stale_token)
+        if store == "file":
+            path = ir_config.get_param("wecom.api_token_store_path") or os.path.join(
+                tempfile.gettempdir(), "wecom_access_tokens.json"
+            )
+            return self._load_access_token_from_file(FileTokenStore(path), stale_token)
+
+        token, expires_at = self._request_access_token()
+        self._update_app_token(token, expires_at)
+        return token, expires_at
+
+    def _load_access_token_from_file(self, file_store, stale_token=None):
+        key = (self.corpid, self.secret)
+        with file_store.locked():
+            entry = file_store.load(key, stale_token)
+            if entry:
+                return entry
+            token, expires_at = self._request_access_token()
+            file_store.save(key, token, expires_at)
+        self._update_app_token(token, expires_at)
+        return token, expires_at
+
+    def _load_access_token_from_database(self, stale_token=None):
+        """
+        使用独立游标加锁读写 wecom_apps 中的令牌，锁在游标提交后释放
         """
+        with self.pool.cursor() as cr:
+            cr.execute(
+                "SELECT pg_advisory_xact_lock(hashtext(%s))",
+                ["wecom_access_token:%s:%s" % (self.corpid, self.secret)],
+            )
+            cr.execute(
+                """
+                SELECT a.access_token, a.expiration_time
+                FROM wecom_apps a
+                JOIN res_company c ON c.id = a.company_id
+                WHERE c.corpid = %s AND a.secret = %s
+                LIMIT 1
+                """,
+                [self.corpid, self.secret],
+            )
+            row = cr.fetchone()
+            if row and row[0] and row[0] != stale_token and row[1]:
+                expires_at = time.mktime(row[1].timetuple())
+                if expires_at - EXPIRY_MARGIN > time.time():
+                    return row[0], expires_at
 
+            token, expires_at = self._request_access_token()
+            cr.execute(
+                """
+                UPDATE wecom_apps a
+                SET access_token = %s, expiration_time = %s
+                FROM res_company c
+                WHERE c.id = a.company_id AND c.corpid = %s AND a.secret = %s
+                """,
+                [
+                    token,
+                    datetime.fromtimestamp(expires_at),
+                    self.corpid,
+                    self.secret,
+                ],
+            )
+        return token, expires_at
+
+    def _request_access_token(self):
+        """
+        请求新令牌
+        :returns (令牌, 过期时间戳)
+        """
         response = self.httpCall(
             self.env["wecom.service_api_list"].get_server_api_call("GET_ACCESS_TOKEN"),
             {"corpid": self.corpid, "corpsecret": self.secret},
         )
-        expiration_second = timedelta(seconds=response["expires_in"])
+        return response.get("access_token"), time.time() + response["expires_in"]
 
-        dict = {
-            "access_token": response.get("access_token"),
-            "expiration_time": datetime.now() + expiration_second,
-        }
-
-        self.sudo().write(dict)
-
-        # 写对应的应用的值
+    def _update_app_token(self, token, expires_at):
+        """
+        写对应的应用 'wecom.apps' 的令牌
+        """
         compay_id = self.env["res.company"].search(
             [("corpid", "=", self.corpid)], limit=1
         )
@@ -75,7 +156,12 @@ class WecomServerApi(models.TransientModel):
             [("company_id", "=", compay_id.id), ("secret", "=", self.secret)], limit=1
         )
 
-        app_id.sudo().write(dict)
+        app_id.sudo().write(
+            {
+                "access_token": token,
+                "expiration_time": datetime.fromtimestamp(expires_at),
+            }
+        )
 
     def get_api_debug(self):
         """
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 令牌提前过期的秒数，避免令牌在请求途中失效
+EXPIRY_MARGIN = 300
+
+
+class AccessTokenCache(object):
+    """
+    进程级访问令牌缓存，键为 (corpid, secret)
+    同一个键同一时间只有一个线程刷新令牌，其他线程等待并复用刷新结果
+    """
+
+    def __init__(self, margin=EXPIRY_MARGIN):
+        self.margin = margin
+        self._tokens = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        获取未过期的令牌
+        :param key: (corpid, secret)
+        :returns 令牌，不存在或即将过期时返回 None
+        """
+        entry = self._tokens.get(key)
+        if entry and entry[1] - self.margin > time.time():
+            return entry[0]
+        return None
+
+    def set(self, key, token, expires_at):
+        self._tokens[key] = (token, expires_at)
+
+    def invalidate(self, key, token=None):
+        """
+        作废令牌
+        :param token: 指定时仅当缓存的令牌与之相同才作废，避免作废其他线程刚刷新的令牌
+        """
+        entry = self._tokens.get(key)
+        if entry and (token is None or entry[0] == token):
+            self._tokens.pop(key, None)
+
+    def get_or_refresh(self, key, refresh):
+        """
+        获取令牌，缓存中不存在时调用 refresh 刷新
+        :param key: (corpid, secret)
+        :param refresh: 无参函数，返回 (令牌, 过期时间戳)
+        :returns 令牌
+        """
+        token = self.get(key)
+        if token:
+            return token
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            token = self.get(key)
+            if token:
+                return token
+            token, expires_at = refresh()
+            self.set(key, token, expires_at)
+            return token
+
+
+class FileTokenStore(object):
+    """
+    基于本地文件的跨进程令牌存储，文件中只保存 (corpid, secret) 的摘要
+    """
+
+    def __init__(self, path, margin=EXPIRY_MARGIN):
+        self.path = path
+        self.margin = margin
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha1(("%s:%s" % key).encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def locked(self):
+        """
+        文件排他锁，持有锁期间其他进程无法刷新令牌
+        """
+        with open(self.path + ".lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def load(self, key, stale_token=None):
+        """
+        :param stale_token: 已失效的令牌，与存储的令牌相同时视为不存在
+        :returns (令牌, 过期时间戳) 或 None
+        """
+        entry = self._read().get(self._digest(key))
+        if not entry or entry[0] == stale_token:
+            return None
+        if entry[1] - self.margin <= time.time():
+            return None
+        return entry[0], entry[1]
+
+    def save(self, key, token, expires_at):
+        now = time.time()
+        data = {
+            digest: entry for digest, entry in self._read().items() if entry[1] > now
+        }
+        data[self._digest(key)] = [token, expires_at]
+        tmp_path = "%s.%s.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+
+token_cache = AccessTokenCache()
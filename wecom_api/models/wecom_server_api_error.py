@@ -10,7 +10,7 @@ pd.set_option("max_colwidth", 4096)
 
 from lxml import etree
 import requests
-from odoo import api, fields, models, SUPERUSER_ID, _
+from odoo import api, fields, models, tools, SUPERUSER_ID, _
 
 _logger = logging.getLogger(__name__)
 
@@ -28,13 +28,39 @@ class WecomServerApiError(models.Model):
     sequence = fields.Integer(default=0)
 
     def get_error_by_code(self, code):
-        res = self.search([("code", "=", code)], limit=1,)
+        name, method = self._get_error_index().get(code, (False, False))
         return {
-            "code": res.code,
-            "name": res.name,
-            "method": res.method,
+            "code": code if name else 0,
+            "name": name,
+            "method": method,
         }
 
+    @tools.ormcache()
+    def _get_error_index(self):
+        """
+        错误码索引，缓存在 ormcache 中，增删改错误码时清除缓存
+        :returns {错误码: (错误说明, 排查方法)}
+        """
+        index = {}
+        for res in self.sudo().search_read(
+            [], ["code", "name", "method"], order="sequence desc"
+        ):
+            index[res["code"]] = (res["name"], res["method"])
+        return index
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.clear_caches()
+        return super(WecomServerApiError, self).create(vals_list)
+
+    def write(self, vals):
+        self.clear_caches()
+        return super(WecomServerApiError, self).write(vals)
+
+    def unlink(self):
+        self.clear_caches()
+        return super(WecomServerApiError, self).unlink()
+
     def cron_pull_global_error_code(self):
         self.pull()
 
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import re
-from odoo import api, fields, models, SUPERUSER_ID, _
+from odoo import api, fields, models, tools, SUPERUSER_ID, _
 
 
 class WecomServerApiList(models.Model):
@@ -48,6 +48,12 @@ class WecomServerApiList(models.Model):
     )
     description = fields.Html(string="Description")
     sequence = fields.Integer(default=0)
+    rate_limit = fields.Integer(
+        "Rate limit (calls per minute)",
+        default=9000,
+        help="Maximum number of calls per minute for each company, 0 means no limit. "
+        "WeCom limits a single API to 10000 calls per minute per company.",
+    )
 
     _sql_constraints = [
         ("function_name_uniq", "unique (function_name)", "The function is unique !",),
@@ -57,11 +63,40 @@ class WecomServerApiList(models.Model):
         """
         根据函数名称获取 企业微信API的路由和请求方式
         :param function_name : 函数名称
-        :returns 企业微信API的路由和请求方式的集合
+        :returns 企业微信API的路由、请求方式、函数名称和每分钟调用次数上限的集合
+        """
+        # ['/cgi-bin/gettoken', 'GET', 'GET_ACCESS_TOKEN', 9000]
+        short_url, request_type, rate_limit = self._get_server_api_routes().get(
+            function_name, (False, False, 0)
+        )
+        return [short_url, request_type, function_name, rate_limit]
+
+    @tools.ormcache()
+    def _get_server_api_routes(self):
+        """
+        加载全部API路由，缓存在 ormcache 中，增删改API列表时清除缓存
+        :returns {函数名称: (路由, 请求方式, 每分钟调用次数上限)}
         """
-        # ['/cgi-bin/gettoken', 'GET']
-        data = []
-        res = self.search([("function_name", "=", function_name)], limit=1,)
-        data.append(res.short_url)
-        data.append(res.request_type)
-        return data
+        routes = {}
+        for res in self.sudo().search_read(
+            [], ["function_name", "short_url", "request_type", "rate_limit"]
+        ):
+            routes[res["function_name"]] = (
+                res["short_url"],
+                res["request_type"],
+                res["rate_limit"],
+            )
+        return routes
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.clear_caches()
+        return super(WecomServerApiList, self).create(vals_list)
+
+    def write(self, vals):
+        self.clear_caches()
+        return super(WecomServerApiList, self).write(vals)
+
+    def unlink(self):
+        self.clear_caches()
+        return super(WecomServerApiList, self).unlink()
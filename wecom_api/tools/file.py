@@ -2,15 +2,59 @@
 
 from odoo import api, models, tools, _
 import base64
-import requests
+import hashlib
 import io
 import os
 import platform
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from odoo.modules.module import get_module_resource
+from odoo.tools.lru import LRU
+
+from ..api.wecom_executor import DEFAULT_MAX_WORKERS
+from ..api.wecom_http_pool import (
+    get_session,
+    DEFAULT_POOL_MAXSIZE,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_READ_TIMEOUT,
+)
 
 _logger = logging.getLogger(__name__)
 
+# 默认头像，每个进程只从磁盘读取一次 {图片名称: base64}
+_default_avatars = {}
+_default_avatars_lock = threading.Lock()
+
+# 头像缓存，键为头像URL，值为 (ETag, 图片内容的sha1)，不缓存图片内容
+# sha1 与 ir.attachment 的 checksum 算法一致，可以直接比较头像是否变化
+AVATAR_CACHE_SIZE = 65536
+_avatar_cache = LRU(AVATAR_CACHE_SIZE)
+
+
+def fetch_avatar(
+    avatar_url, timeout=None, pool_maxsize=DEFAULT_POOL_MAXSIZE, need_content=False
+):
+    """
+    下载头像，只做网络IO，不访问 Odoo 环境，可以在线程中执行
+    已缓存的头像使用 If-None-Match 请求，未变化时服务器返回 304，不下载图片内容
+    :param need_content: 是否必须返回图片内容，为 True 时不使用缓存
+    :returns (图片内容的sha1, base64)，头像未变化时 base64 为 None
+    """
+    cached = None if need_content else _avatar_cache.get(avatar_url)
+    headers = {}
+    if cached and cached[0]:
+        headers["If-None-Match"] = cached[0]
+    response = get_session(avatar_url, pool_maxsize).get(
+        avatar_url, headers=headers, timeout=timeout
+    )
+    if response.status_code == 304 and cached:
+        return cached[1], None
+    response.raise_for_status()
+    checksum = hashlib.sha1(response.content).hexdigest()
+    _avatar_cache[avatar_url] = (response.headers.get("ETag"), checksum)
+    return checksum, base64.b64encode(response.content)
+
 
 class WecomApiToolsFile(models.AbstractModel):
     _name = "wecomapi.tools.file"
@@ -29,23 +73,122 @@ class WecomApiToolsFile(models.AbstractModel):
             os.makedirs(filepath)
         return filepath
 
+    def get_default_avatar_base64(self, gender):
+        """
+        获取默认头像的base64编码，每个进程只读取一次
+        :param gender: 性别。0表示未定义，1表示男性，2表示女性
+        """
+        image_name = "default_image.png"
+        if gender == "1":
+            image_name = "default_male_image.png"
+        elif gender == "2":
+            image_name = "default_female_image.png"
+
+        imgbase64 = _default_avatars.get(image_name)
+        if imgbase64 is None:
+            with _default_avatars_lock:
+                imgbase64 = _default_avatars.get(image_name)
+                if imgbase64 is None:
+                    default_image = get_module_resource(
+                        "wecom_contacts_sync", "static/src/img", image_name
+                    )
+                    with open(default_image, "rb") as f:
+                        imgbase64 = base64.b64encode(f.read())
+                    _default_avatars[image_name] = imgbase64
+        return imgbase64
+
     def get_avatar_base64(self, use_default_avatar, gender, avatar_url):
         """
         获取企业微信用户头像的base64编码
         return:返回base64
         """
-        imgbase64 = ""
-        if use_default_avatar or avatar_url == "":
-            image_name = "default_image.png"
-            if gender == "1":
-                image_name = "default_male_image.png"
-            elif gender == "2":
-                image_name = "default_female_image.png"
-
-            default_image = get_module_resource("wecom_contacts_sync", "static/src/img", image_name)
-            # print(default_image)
-            with open(default_image, "rb") as f:
-                imgbase64 = base64.b64encode(f.read())
+        if use_default_avatar or not avatar_url:
+            return self.get_default_avatar_base64(gender)
+        pool_maxsize, timeout = self.get_http_options()
+        return fetch_avatar(avatar_url, timeout, pool_maxsize, need_content=True)[1]
+
+    def get_http_options(self):
+        """
+        获取下载文件的连接池大小和超时设置，与API调用共用参数
+        :returns (连接池大小, (连接超时, 读取超时))
+        """
+        ir_config = self.env["ir.config_parameter"].sudo()
+        pool_maxsize = int(
+            ir_config.get_param("wecom.api_pool_maxsize", DEFAULT_POOL_MAXSIZE)
+        )
+        timeout = (
+            float(
+                ir_config.get_param(
+                    "wecom.api_connect_timeout", DEFAULT_CONNECT_TIMEOUT
+                )
+            ),
+            float(ir_config.get_param("wecom.api_read_timeout", DEFAULT_READ_TIMEOUT)),
+        )
+        return pool_maxsize, timeout
+
+    def get_avatars(self, avatar_urls, max_workers=None, content_urls=None):
+        """
+        并发下载头像，相同的URL只下载一次
+        :param avatar_urls: 头像URL列表
+        :param max_workers: 最大并发数，默认取参数 "wecom.api_max_workers"
+        :param content_urls: 必须返回图片内容的头像URL，例如新建员工的头像
+        :returns {头像URL: (图片内容的sha1, base64)}，头像未变化时 base64 为 None，下载失败的URL不在结果中
+        """
+        content_urls = set(content_urls or [])
+        avatar_urls = list({url for url in list(avatar_urls) + list(content_urls) if url})
+        if not avatar_urls:
+            return {}
+        if max_workers is None:
+            max_workers = int(
+                self.env["ir.config_parameter"]
+                .sudo()
+                .get_param("wecom.api_max_workers", DEFAULT_MAX_WORKERS)
+            )
+        pool_maxsize, timeout = self.get_http_options()
+
+        def run(avatar_url):
+            try:
+                return fetch_avatar(
+                    avatar_url, timeout, pool_maxsize, avatar_url in content_urls
+                )
+            except Exception as e:
+                return e
+
+        if max_workers <= 1 or len(avatar_urls) <= 1:
+            results = [run(url) for url in avatar_urls]
         else:
-            imgbase64 = base64.b64encode(requests.get(avatar_url).content)
-        return imgbase64
+            with ThreadPoolExecutor(
+                max_workers=min(max_workers, len(avatar_urls))
+            ) as executor:
+                results = list(executor.map(run, avatar_urls))
+
+        avatars = {}
+        for avatar_url, result in zip(avatar_urls, results):
+            if isinstance(result, Exception):
+                _logger.warning(
+                    "Failed to download avatar [%s], reason: %s", avatar_url, repr(result)
+                )
+                continue
+            avatars[avatar_url] = result
+        return avatars
+
+    def get_image_checksums(self, records, field_name="image_1920"):
+        """
+        一次查询记录图片字段附件的sha1
+        :returns {记录ID: sha1}
+        """
+        if not records:
+            return {}
+        attachments = (
+            self.env["ir.attachment"]
+            .sudo()
+            .search_read(
+                [
+                    ("res_model", "=", records._name),
+                    ("res_field", "=", field_name),
+                    ("res_id", "in", records.ids),
+                ],
+                ["res_id", "checksum"],
+            )
+        )
+        return {attachment["res_id"]: attachment["checksum"] for attachment in attachments}
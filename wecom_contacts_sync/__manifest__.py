@@ -23,6 +23,7 @@
         "data/wecom_app_config_data.xml",
         "data/wecom_app_event_type_data.xml",
         "data/ir_cron_data.xml",
+        "data/ir_config_parameter.xml",
         "data/hr_data.xml",
         "wizard/employee_bind_wecom_views.xml",
         "wizard/user_bind_wecom_views.xml",
@@ -2,11 +2,15 @@
 
 import time
 import logging
+from collections import defaultdict
 from lxml import etree
 from odoo import api, fields, models, _, Command, tools
 
 _logger = logging.getLogger(__name__)
 
+# 批量创建员工时每批的数量
+EMPLOYEE_BATCH_SIZE = 500
+
 class HrEmployeePrivate(models.Model):
     _inherit = "hr.employee"
     # _order = "wecom_user_order"
@@ -128,6 +132,8 @@ class HrEmployeePrivate(models.Model):
     def sync_wecom_user(self):
         """
         同步企微成员
+        两次查询按 企微用户ID 和 企微open_userid 索引已有员工，在内存中计算需要创建和更新的员工，
+        批量创建员工，创建和更新时不执行邮件线程功能(跟踪、订阅、记录创建消息)
         """
         start_time = time.time()
         tasks = {}
@@ -136,8 +142,6 @@ class HrEmployeePrivate(models.Model):
         else:
             company = self.env.company
 
-        wecom_users = self.env['wecom.user'].search([('company_id','=',company.id)])
-
         app_config = self.env["wecom.app_config"].sudo()
         contacts_use_default_avatar = app_config.get_param(
             company.contacts_app_id.id,
@@ -148,36 +152,136 @@ class HrEmployeePrivate(models.Model):
             "contacts_update_avatar_every_time_sync_employees",
         )  # 每次同步都更新头像的标识
         # TODO 待处理 通讯录展示组件 获取企微成员的相关属性
+        phase_times = {}
         try:
+            # 1.索引已有员工
+            phase_start_time = time.time()
+            wecom_users = self.env['wecom.user'].search([('company_id','=',company.id)])
+            employees_by_userid = self.get_employee_index(
+                company, "wecom_userid", wecom_users.mapped("userid")
+            )
+            employees_by_openid = self.get_employee_index(
+                company, "wecom_openid", wecom_users.mapped("open_userid")
+            )
+
+            create_vals_list = []
+            create_wecom_users = []
+            update_employees = defaultdict(lambda: self.browse())
+            avatar_employees = []
             for wecom_user in wecom_users:
                 # 从企业微信同步员工
-                employee = self.search([('wecom_userid','=',wecom_user.userid)])
+                employee = employees_by_userid.get(wecom_user.userid)
                 if not employee:
-                    employee = self.search([('wecom_openid','=',wecom_user.open_userid)])
+                    employee = employees_by_openid.get(wecom_user.open_userid)
 
                 if not employee:
-                    employee = self.sudo().create({
+                    create_vals_list.append({
                         'company_id':company.id,
                         'name':wecom_user.name,
                         'work_phone':None, # 避免使用公司的电话
                         'wecom_user':wecom_user.id,
                         'is_wecom_user':True,
                         "marital": None,  # 不生成婚姻状况
-                        # "image_1920": self.env["wecomapi.tools.file"].get_avatar_base64(
-                        #     contacts_use_default_avatar,
-                        #     wecom_employee["gender"],
-                        #     wecom_employee["avatar"],
-                        # ),
                     })
+                    create_wecom_users.append(wecom_user)
                 else:
-                    employee.sudo().write({
-                        'name':wecom_user.name,
+                    update_employees[wecom_user.name] |= employee.filtered(
+                        lambda e: e.name != wecom_user.name
+                    )
+                    if contacts_update_avatar:
+                        avatar_employees.append((employee, wecom_user))
+            phase_times["index"] = time.time() - phase_start_time
+
+            # 2.并发下载头像，相同的URL只下载一次，未变化的头像不下载图片内容
+            phase_start_time = time.time()
+            tools_file = self.env["wecomapi.tools.file"]
+            avatar_urls = [
+                wecom_user.avatar for employee, wecom_user in avatar_employees
+            ]
+            content_urls = []
+            if not contacts_use_default_avatar:
+                content_urls = [wecom_user.avatar for wecom_user in create_wecom_users]
+            avatars = tools_file.get_avatars(avatar_urls, content_urls=content_urls)
+
+            def get_avatar(wecom_user, use_default_avatar):
+                avatar = avatars.get(wecom_user.avatar)
+                if use_default_avatar or not avatar:
+                    return tools_file.get_default_avatar_base64(wecom_user.gender)
+                return avatar[1]
+
+            for vals, wecom_user in zip(create_vals_list, create_wecom_users):
+                vals["image_1920"] = get_avatar(
+                    wecom_user, contacts_use_default_avatar
+                )
+            phase_times["avatar"] = time.time() - phase_start_time
+
+            Employee = self.sudo().with_context(
+                mail_create_nosubscribe=True,
+                mail_create_nolog=True,
+                mail_notrack=True,
+                tracking_disable=True,
+            )
+
+            # 3.批量创建员工
+            phase_start_time = time.time()
+            for vals_list in tools.split_every(
+                EMPLOYEE_BATCH_SIZE, create_vals_list, list
+            ):
+                Employee.create(vals_list)
+            phase_times["create"] = time.time() - phase_start_time
+
+            # 4.按姓名分组更新员工
+            phase_start_time = time.time()
+            updated_ids = set()
+            for name, employees in update_employees.items():
+                if employees:
+                    employees.with_env(Employee.env).write({
+                        'name':name,
                     })
+                    updated_ids.update(employees.ids)
+
+            # 只更新变化的头像，与附件的sha1比较
+            checksums = tools_file.get_image_checksums(
+                self.browse(
+                    [
+                        employee.id
+                        for employees, wecom_user in avatar_employees
+                        for employee in employees
+                    ]
+                )
+            )
+            changed_avatars = []
+            for employees, wecom_user in avatar_employees:
+                avatar = avatars.get(wecom_user.avatar)
+                if not avatar:
+                    continue
+                changed = employees.filtered(
+                    lambda e: checksums.get(e.id) != avatar[0]
+                )
+                if changed:
+                    changed_avatars.append((changed, wecom_user.avatar))
+            # 头像未变化但与附件不同时，才下载图片内容
+            missing_urls = [
+                avatar_url
+                for changed, avatar_url in changed_avatars
+                if avatars[avatar_url][1] is None
+            ]
+            if missing_urls:
+                avatars.update(
+                    tools_file.get_avatars(missing_urls, content_urls=missing_urls)
+                )
+            for changed, avatar_url in changed_avatars:
+                imgbase64 = avatars[avatar_url][1]
+                if imgbase64:
+                    changed.with_env(Employee.env).write({"image_1920": imgbase64})
+                    updated_ids.update(changed.ids)
+            phase_times["update"] = time.time() - phase_start_time
         except Exception as e:
             end_time = time.time()
             tasks = {
                 "state": False,
                 "time": end_time - start_time,
+                "phase_times": phase_times,
                 "msg": str(e),
             }
         else:
@@ -185,7 +289,36 @@ class HrEmployeePrivate(models.Model):
             tasks = {
                 "state": True,
                 "time": end_time - start_time,
-                "msg": _("Successfully synchronized wecom employees"),
+                "phase_times": phase_times,
+                "msg": _("Successfully synchronized wecom employees")
+                + "\n"
+                + _(
+                    "Created %s employees in %.2f seconds, updated %s employees in %.2f seconds, indexing took %.2f seconds."
+                )
+                % (
+                    len(create_vals_list),
+                    phase_times["create"],
+                    len(updated_ids),
+                    phase_times["update"],
+                    phase_times["index"],
+                ),
             }
         finally:
             return tasks
+
+    def get_employee_index(self, company, field_name, values):
+        """
+        一次查询按企微字段索引公司的员工
+        :param field_name: "wecom_userid" 或 "wecom_openid"
+        :param values: 字段值列表，忽略空值
+        :returns {字段值: 员工}
+        """
+        values = [value for value in set(values) if value]
+        index = defaultdict(lambda: self.browse())
+        if not values:
+            return index
+        for employee in self.search(
+            [("company_id", "=", company.id), (field_name, "in", values)]
+        ):
+            index[employee[field_name]] |= employee
+        return index
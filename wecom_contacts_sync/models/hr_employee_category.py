@@ -3,6 +3,7 @@
 import logging
 import base64
 import time
+from collections import defaultdict
 from lxml import etree
 from odoo import api, fields, models, _
 
@@ -425,17 +426,39 @@ class EmployeeCategory(models.Model):
                 ]
             else:
                 tags = response["taglist"]
-                for tag in tags:
-                    category = self.search(
-                        [
-                            ("tagid", "=", tag["tagid"]),
-                            ("company_id", "=", company.id),
-                        ],
-                        limit=1,
-                    )
+                # 并发获取所有标签的成员
+                member_responses = wxapi.httpCallBatch(
+                    [
+                        (
+                            self.env["wecom.service_api_list"].get_server_api_call(
+                                "TAG_GET_MEMBER"
+                            ),
+                            {"tagid": str(tag["tagid"])},
+                        )
+                        for tag in tags
+                    ]
+                )
+                blocked_userids = self.env[
+                    "wecom.contacts.block"
+                ].get_blocked_userids(company)
+                # 所有标签共用的员工、部门和标签索引
+                employee_index, department_index = self.get_tag_member_indexes(
+                    company
+                )
+                categories = {}
+                for category in self.search(
+                    [
+                        ("tagid", "in", [tag["tagid"] for tag in tags]),
+                        ("company_id", "=", company.id),
+                    ],
+                    order="id desc",
+                ):
+                    categories[category.tagid] = category
+                for tag, member_response in zip(tags, member_responses):
+                    category = categories.get(tag["tagid"], self.browse())
 
                     if not category:
-                        category.create(
+                        category = category.create(
                             {
                                 "name": tag["tagname"],
                                 "tagid": tag["tagid"],
@@ -447,7 +470,14 @@ class EmployeeCategory(models.Model):
                             {"name": tag["tagname"], "is_wecom_tag": True,}
                         )
                     result = self.download_wecom_tag_member(
-                        category, wxapi, tag["tagid"], company
+                        category,
+                        wxapi,
+                        tag["tagid"],
+                        company,
+                        member_response,
+                        blocked_userids,
+                        employee_index,
+                        department_index,
                     )
                     if result:
                         tasks.append(
@@ -484,18 +514,73 @@ class EmployeeCategory(models.Model):
             ]
         return tasks
 
-    def download_wecom_tag_member(self, category, wxapi, tagid, company):
+    def get_tag_member_indexes(self, company):
+        """
+        一次查询公司的企微员工和企微部门，同步多个标签的成员时复用
+        :returns ({小写的企微用户ID: 员工ID}, {企微部门ID: [部门ID, ...]})
+        """
+        employee_index = {}
+        for employee in (
+            self.env["hr.employee"]
+            .sudo()
+            .with_context(active_test=False)
+            .search_read(
+                [("company_id", "=", company.id), ("is_wecom_user", "=", True)],
+                ["wecom_userid"],
+            )
+        ):
+            if employee["wecom_userid"]:
+                employee_index.setdefault(
+                    employee["wecom_userid"].lower(), employee["id"]
+                )
+
+        department_index = defaultdict(list)
+        for department in (
+            self.env["hr.department"]
+            .sudo()
+            .with_context(active_test=False)
+            .search_read(
+                [
+                    ("company_id", "=", company.id),
+                    ("is_wecom_department", "=", True),
+                ],
+                ["wecom_department_id"],
+            )
+        ):
+            department_index[department["wecom_department_id"]].append(
+                department["id"]
+            )
+        return employee_index, department_index
+
+    def download_wecom_tag_member(
+        self,
+        category,
+        wxapi,
+        tagid,
+        company,
+        response=None,
+        blocked_userids=None,
+        employee_index=None,
+        department_index=None,
+    ):
         """
         下载企微标签成员
+        :param response: 已获取的 TAG_GET_MEMBER 结果，为空时调用API获取
+        :param blocked_userids: 屏蔽的企微用户ID集合，为空时查询
+        :param employee_index: 员工索引，为空时查询，参见 get_tag_member_indexes
+        :param department_index: 部门索引，为空时查询，参见 get_tag_member_indexes
         """
         res = {}
         try:
-            response = wxapi.httpCall(
-                self.env["wecom.service_api_list"].get_server_api_call(
-                    "TAG_GET_MEMBER"
-                ),
-                {"tagid": str(tagid)},
-            )
+            if response is None:
+                response = wxapi.httpCall(
+                    self.env["wecom.service_api_list"].get_server_api_call(
+                        "TAG_GET_MEMBER"
+                    ),
+                    {"tagid": str(tagid)},
+                )
+            elif isinstance(response, ApiException):
+                raise response
         except ApiException as ex:
             self.env["wecomapi.tools.action"].ApiExceptionDialog(
                 ex, raise_exception=False
@@ -504,7 +589,7 @@ class EmployeeCategory(models.Model):
                 "name": "download_tag_members",
                 "state": False,
                 "time": 0,
-                "msg": repr(e),
+                "msg": repr(ex),
             }
         except Exception as e:
             res = {
@@ -514,46 +599,23 @@ class EmployeeCategory(models.Model):
                 "msg": repr(e),
             }
         else:
-            employee_ids = []
-            for user in response["userlist"]:
-                employee = (
-                    self.env["hr.employee"]
-                    .sudo()
-                    .search(
-                        [
-                            ("wecom_userid", "=", user["userid"].lower()),
-                            ("company_id", "=", company.id),
-                            ("is_wecom_user", "=", True),
-                            "|",
-                            ("active", "=", True),
-                            ("active", "=", False),
-                        ],
-                        limit=1,
-                    )
+            if employee_index is None or department_index is None:
+                employee_index, department_index = self.get_tag_member_indexes(
+                    company
                 )
-                if employee:
-                    employee_ids.append(employee.id)
+            employee_ids = []
+            for user in self.env["wecom.contacts.block"].filter_users(
+                company, response["userlist"], blocked_userids=blocked_userids
+            ):
+                employee_id = employee_index.get(user["userid"].lower())
+                if employee_id:
+                    employee_ids.append(employee_id)
             if len(employee_ids) > 0:
                 category.write({"employee_ids": [(6, 0, employee_ids)]})
 
             department_ids = []
             for party in response["partylist"]:
-                department = (
-                    self.env["hr.department"]
-                    .sudo()
-                    .search(
-                        [
-                            ("wecom_department_id", "=", party),
-                            ("is_wecom_department", "=", True),
-                            ("company_id", "=", company.id),
-                            "|",
-                            ("active", "=", True),
-                            ("active", "=", False),
-                        ],
-                    )
-                )
-                if department:
-                    department_ids.append(department.id)
+                department_ids.extend(department_index.get(party, []))
             if len(department_ids) > 0:
                 category.write({"department_ids": [(6, 0, department_ids)]})
         finally:
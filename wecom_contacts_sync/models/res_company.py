@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+from odoo import fields, models
+
+
+class Company(models.Model):
+    _inherit = "res.company"
+
+    # 通讯录同步状态
+    wecom_contacts_last_full_sync = fields.Datetime(
+        string="Last full synchronization time of contacts (UTC)",
+        copy=False,
+        readonly=True,
+    )
+    wecom_contacts_dept_user_hash = fields.Char(
+        string="Checksum of WeCom user ID list",
+        copy=False,
+        readonly=True,
+    )  # 上次同步时企微成员ID列表(userid和部门)的摘要，用于增量同步时判断成员是否有变化
@@ -97,17 +97,37 @@ class PartnerCategory(models.Model):
                 ]
             else:
                 tags = response["taglist"]
-                for tag in tags:
-                    category = self.search(
-                        [
-                            ("tagid", "=", tag["tagid"]),
-                            ("company_id", "=", company.id),
-                        ],
-                        limit=1,
-                    )
+                # 并发获取所有标签的成员
+                member_responses = wxapi.httpCallBatch(
+                    [
+                        (
+                            self.env["wecom.service_api_list"].get_server_api_call(
+                                "TAG_GET_MEMBER"
+                            ),
+                            {"tagid": str(tag["tagid"])},
+                        )
+                        for tag in tags
+                    ]
+                )
+                blocked_userids = self.env[
+                    "wecom.contacts.block"
+                ].get_blocked_userids(company)
+                # 所有标签共用的联系人和标签索引
+                partner_index = self.get_tag_member_index(company)
+                categories = {}
+                for category in self.search(
+                    [
+                        ("tagid", "in", [tag["tagid"] for tag in tags]),
+                        ("company_id", "=", company.id),
+                    ],
+                    order="id desc",
+                ):
+                    categories[category.tagid] = category
+                for tag, member_response in zip(tags, member_responses):
+                    category = categories.get(tag["tagid"], self.browse())
 
                     if not category:
-                        category.create(
+                        category = category.create(
                             {
                                 "name": tag["tagname"],
                                 "tagid": tag["tagid"],
@@ -119,7 +139,13 @@ class PartnerCategory(models.Model):
                             {"name": tag["tagname"], "is_wecom_tag": True,}
                         )
                     result = self.download_wecom_tag_member(
-                        category, wxapi, tag["tagid"], company
+                        category,
+                        wxapi,
+                        tag["tagid"],
+                        company,
+                        member_response,
+                        blocked_userids,
+                        partner_index,
                     )
                     if result:
                         tasks.append(
@@ -156,18 +182,52 @@ class PartnerCategory(models.Model):
             ]
         return tasks
 
-    def download_wecom_tag_member(self, category, wxapi, tagid, company):
+    def get_tag_member_index(self, company):
+        """
+        一次查询公司的企微联系人，同步多个标签的成员时复用
+        :returns {小写的企微用户ID: 联系人ID}
+        """
+        partner_index = {}
+        for partner in (
+            self.env["res.partner"]
+            .sudo()
+            .with_context(active_test=False)
+            .search_read(
+                [("company_id", "=", company.id), ("is_wecom_user", "=", True)],
+                ["wecom_userid"],
+            )
+        ):
+            if partner["wecom_userid"]:
+                partner_index.setdefault(partner["wecom_userid"].lower(), partner["id"])
+        return partner_index
+
+    def download_wecom_tag_member(
+        self,
+        category,
+        wxapi,
+        tagid,
+        company,
+        response=None,
+        blocked_userids=None,
+        partner_index=None,
+    ):
         """
         下载企微标签成员
+        :param response: 已获取的 TAG_GET_MEMBER 结果，为空时调用API获取
+        :param blocked_userids: 屏蔽的企微用户ID集合，为空时查询
+        :param partner_index: 联系人索引，为空时查询，参见 get_tag_member_index
         """
         res = {}
         try:
-            response = wxapi.httpCall(
-                self.env["wecom.service_api_list"].get_server_api_call(
-                    "TAG_GET_MEMBER"
-                ),
-                {"tagid": str(tagid)},
-            )
+            if response is None:
+                response = wxapi.httpCall(
+                    self.env["wecom.service_api_list"].get_server_api_call(
+                        "TAG_GET_MEMBER"
+                    ),
+                    {"tagid": str(tagid)},
+                )
+            elif isinstance(response, ApiException):
+                raise response
         except ApiException as ex:
             self.env["wecomapi.tools.action"].ApiExceptionDialog(
                 ex, raise_exception=False
@@ -176,7 +236,7 @@ class PartnerCategory(models.Model):
                 "name": "download_tag_members",
                 "state": False,
                 "time": 0,
-                "msg": repr(e),
+                "msg": repr(ex),
             }
         except Exception as e:
             res = {
@@ -186,25 +246,15 @@ class PartnerCategory(models.Model):
                 "msg": repr(e),
             }
         else:
+            if partner_index is None:
+                partner_index = self.get_tag_member_index(company)
             partner_ids = []
-            for user in response["userlist"]:
-                partner = (
-                    self.env["res.partner"]
-                    .sudo()
-                    .search(
-                        [
-                            ("wecom_userid", "=", user["userid"].lower()),
-                            ("company_id", "=", company.id),
-                            ("is_wecom_user", "=", True),
-                            "|",
-                            ("active", "=", True),
-                            ("active", "=", False),
-                        ],
-                        limit=1,
-                    )
-                )
-                if partner:
-                    partner_ids.append(partner.id)
+            for user in self.env["wecom.contacts.block"].filter_users(
+                company, response["userlist"], blocked_userids=blocked_userids
+            ):
+                partner_id = partner_index.get(user["userid"].lower())
+                if partner_id:
+                    partner_ids.append(partner_id)
             if len(partner_ids) > 0:
                 category.write({"partner_ids": [(6, 0, partner_ids)]})
 
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import secrets
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from odoo import fields, models, api, Command, tools, _
 from odoo.exceptions import UserError
 from lxml import etree
@@ -10,6 +13,10 @@ from odoo.addons.base.models.ir_mail_server import MailDeliveryException
 
 _logger = logging.getLogger(__name__)
 
+# 批量创建用户时每批的数量
+USER_BATCH_SIZE = 100
+# 并发计算密码哈希的线程数，hashlib 计算 pbkdf2 时会释放 GIL
+PASSWORD_HASH_WORKERS = 4
 
 
 class User(models.Model):
@@ -117,6 +124,138 @@ class User(models.Model):
             return user.id
             # return SudoUser.with_context(send_mail=send_mail).create(values).id
 
+    def _create_users_by_wecom_employees(self, employees, send_mail, send_message):
+        """
+        通过员工批量创建用户
+        1. 一次查询已存在的登录账号，已存在的跳过
+        2. 不执行邮件线程功能，按批次 create(vals_list) 创建用户，批次失败时逐个创建以记录失败的员工
+        3. 创建时不设置密码，之后在线程池中并发计算随机密码的哈希
+        4. 按公司一次更新用户的合作伙伴
+        :returns [{"state": 状态, "result": 失败原因}, ...]
+        """
+        results = []
+        logins = {}
+        for employee in employees:
+            if not employee.wecom_userid:
+                results.append(
+                    {
+                        "state": False,
+                        "result": _(
+                            "Failed to copy employee [%s] as system user, reason:%s"
+                        )
+                        % (employee.name, _("Missing WeCom user ID")),
+                    }
+                )
+                continue
+            logins[employee] = tools.ustr(employee.wecom_userid)
+        if not logins:
+            return results
+
+        existing_logins = set()
+        for lower_logins in tools.split_every(
+            1000, list({login.lower() for login in logins.values()}), tuple
+        ):
+            self.env.cr.execute(
+                "SELECT lower(login) FROM res_users WHERE lower(login) IN %s",
+                (lower_logins,),
+            )
+            existing_logins.update(row[0] for row in self.env.cr.fetchall())
+
+        group_portal_id = self.env["ir.model.data"]._xmlid_to_res_id(
+            "base.group_portal"
+        )  # 门户用户组
+        new_employees = []
+        vals_list = []
+        for employee, login in logins.items():
+            if login.lower() in existing_logins:
+                results.append({"state": True, "result": ""})
+                continue
+            existing_logins.add(login.lower())  # 避免同一批次中重复的账号
+            new_employees.append(employee)
+            vals_list.append(
+                {
+                    "name": employee.name,
+                    "login": login,
+                    "notification_type": "inbox",
+                    "groups_id": [(6, 0, [group_portal_id])],
+                    "share": False,
+                    "active": employee.active,
+                    "image_1920": employee.image_1920,
+                    "company_ids": [(6, 0, [employee.company_id.id])],
+                    "company_id": employee.company_id.id,
+                    "employee_ids": [(6, 0, [employee.id])],
+                    "employee_id": employee.id,
+                    "lang": self.env.lang,
+                    # 以下为企业微信字段
+                    "wecom_user": employee.wecom_user.id,
+                    "wecom_userid": employee.wecom_userid.lower(),
+                    "wecom_openid": employee.wecom_openid,
+                    "is_wecom_user": employee.is_wecom_user,
+                    "qr_code": employee.qr_code,
+                }
+            )
+
+        SudoUser = self.sudo().with_context(
+            mail_create_nosubscribe=True,
+            mail_create_nolog=True,
+            mail_notrack=True,
+            tracking_disable=True,
+            send_mail=send_mail,
+            send_message=send_message,
+        )
+        users = SudoUser.browse()
+        for batch in tools.split_every(
+            USER_BATCH_SIZE, list(zip(new_employees, vals_list)), list
+        ):
+            try:
+                with self.env.cr.savepoint():
+                    users |= SudoUser.create([vals for employee, vals in batch])
+                results.extend({"state": True, "result": ""} for vals in batch)
+            except Exception:
+                for employee, vals in batch:
+                    try:
+                        with self.env.cr.savepoint():
+                            users |= SudoUser.create(vals)
+                        results.append({"state": True, "result": ""})
+                    except Exception as e:
+                        results.append(
+                            {
+                                "state": False,
+                                "result": _(
+                                    "Failed to copy employee [%s] as system user, reason:%s"
+                                )
+                                % (employee.name, repr(e)),
+                            }
+                        )
+
+        if users:
+            self._set_random_passwords(users)
+            # 关联公司
+            company_users = defaultdict(lambda: SudoUser.browse())
+            for user in users:
+                company_users[user.company_id] |= user
+            for company, company_user in company_users.items():
+                company_user.partner_id.write(
+                    {
+                        "company_id": company.id,
+                        "parent_id": company.partner_id.id,
+                    }
+                )
+        return results
+
+    def _set_random_passwords(self, users):
+        """
+        为用户设置随机密码，在线程池中并发计算密码哈希
+        """
+        crypt_context = self._crypt_context()
+        passwords = [secrets.token_urlsafe(16) for user in users]
+        with ThreadPoolExecutor(
+            max_workers=min(PASSWORD_HASH_WORKERS, len(passwords))
+        ) as executor:
+            hashed_passwords = list(executor.map(crypt_context.hash, passwords))
+        for user, hashed_password in zip(users, hashed_passwords):
+            self._set_encrypted_password(user.id, hashed_password)
+
     @api.model_create_multi
     def create(self, vals_list):
         """
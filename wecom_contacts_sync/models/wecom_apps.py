@@ -3,6 +3,7 @@
 import logging
 import datetime
 import re
+from concurrent.futures import ThreadPoolExecutor
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError, ValidationError
 
@@ -130,6 +131,11 @@ class WeComApps(models.Model):
                     "wecom_app_config_contacts_update_avatar_every_time_sync_employees",
                 )[1]
             )  # 6
+            contacts_full_sync_interval = ir_model_data.get_object_reference(
+                "wecom_contacts_sync", "wecom_app_config_contacts_full_sync_interval"
+            )[
+                1
+            ]  # 11
             # enabled_join_qrcode = ir_model_data.get_object_reference(
             #     "wecom_contacts_sync", "wecom_app_config_contacts_enabled_join_qrcode"
             # )[
@@ -163,6 +169,7 @@ class WeComApps(models.Model):
                 # join_qrcode,  # 8
                 # join_qrcode_size_type,  # 9
                 # join_qrcode_last_time,  # 10
+                contacts_full_sync_interval,  # 11
             ]
 
             for id in vals_list:
@@ -201,36 +208,60 @@ class WeComApps(models.Model):
     # 通讯录
     # ————————————————————————————————————
 
-    def cron_sync_contacts(self):
+    def cron_sync_contacts(self, full_sync=False):
         """
         自动任务同步组织架构
         同步内容:    1. wecom.department
                     2. wecom.user
                     3. wecom.tag
+        距上次全量同步未超过应用参数 "contacts_full_sync_interval" 时，只做增量核对
+        参数 "wecom.contacts_sync_max_workers" 大于1时，多个公司在线程池中同时同步，每个公司使用独立的游标和事务
+        参数 "wecom.contacts_sync_isolated" 为真时，串行同步的每个公司也使用独立的事务，一个公司失败不会回滚其他公司
+        :param full_sync: 是否强制全量同步
         """
         results = []
         total_time = 0
         sync_start_time = time.time()
 
-        for app in self.search(
+        apps = self.search(
             [("company_id", "!=", False), ("type_code", "=", "['contacts']")]
-        ):
-            _logger.info(
-                _(
-                    "Automatic task: start to synchronize the enterprise wechat organizational structure of the company [%s]"
-                )
-                % (app.company_id.name)
-            )
-
-            result = app.sync_contacts()
-            results.append(result)
+        )
+        if not apps:
+            return
 
-            _logger.info(
-                _(
-                    "Automatic task: end synchronizing the enterprise wechat organizational structure of the company [%s]"
+        ir_config = self.env["ir.config_parameter"].sudo()
+        max_workers = max(
+            1, int(ir_config.get_param("wecom.contacts_sync_max_workers", 1))
+        )
+        isolated = str(
+            ir_config.get_param("wecom.contacts_sync_isolated", False)
+        ).lower() in ("true", "1")
+
+        if max_workers > 1 and len(apps) > 1:
+            # 线程不能共用游标，每个公司使用独立的游标
+            with ThreadPoolExecutor(
+                max_workers=min(max_workers, len(apps))
+            ) as executor:
+                outcomes = list(
+                    executor.map(
+                        lambda app_id: self.sync_company_contacts_in_new_cursor(
+                            app_id, full_sync
+                        ),
+                        apps.ids,
+                    )
                 )
-                % (app.company_id.name)
-            )
+        elif isolated:
+            outcomes = [
+                self.sync_company_contacts_in_new_cursor(app_id, full_sync)
+                for app_id in apps.ids
+            ]
+        else:
+            outcomes = [app.sync_company_contacts(full_sync) for app in apps]
+
+        for app, outcome in zip(apps, outcomes):
+            if isinstance(outcome, Exception):
+                outcome = app.get_sync_contacts_fail_result(outcome)
+            results.append(outcome)
         df = pd.DataFrame(results)
 
         (
@@ -318,6 +349,64 @@ Synchronize Wecom tag results:
             )
         )
 
+    def sync_company_contacts_in_new_cursor(self, app_id, full_sync=False):
+        """
+        使用独立的游标和事务同步公司通讯录，成功时提交，失败时只回滚该公司
+        可以在线程中执行，不访问当前环境的游标
+        :returns 同步结果，失败时为异常实例
+        """
+        try:
+            with self.pool.cursor() as cr:
+                env = api.Environment(cr, self.env.uid, self.env.context)
+                return env["wecom.apps"].browse(app_id).sync_company_contacts(full_sync)
+        except Exception as e:
+            _logger.exception("Failed to synchronize contacts of app [%s]", app_id)
+            return e
+
+    def sync_company_contacts(self, full_sync=False):
+        """
+        自动任务同步公司通讯录，按需全量同步或增量核对
+        """
+        _logger.info(
+            _(
+                "Automatic task: start to synchronize the enterprise wechat organizational structure of the company [%s]"
+            )
+            % (self.company_id.name)
+        )
+
+        if full_sync or self.is_full_sync_contacts_due():
+            result = self.sync_contacts()
+        else:
+            result = self.reconcile_contacts()
+
+        _logger.info(
+            _(
+                "Automatic task: end synchronizing the enterprise wechat organizational structure of the company [%s]"
+            )
+            % (self.company_id.name)
+        )
+        return result
+
+    def get_sync_contacts_fail_result(self, error):
+        """
+        公司通讯录同步异常时的结果
+        """
+        msg = "[%s] %s" % (self.company_id.name, repr(error))
+        return {
+            "company_name": self.company_id.name,
+            "sync_state": "fail",
+            "sync_result": msg,
+            "wecom_department_sync_state": "fail",
+            "wecom_department_sync_times": 0,
+            "wecom_department_sync_result": msg,
+            "wecom_user_sync_state": "fail",
+            "wecom_user_sync_times": 0,
+            "wecom_user_sync_result": "",
+            "wecom_tag_sync_state": "fail",
+            "wecom_tag_sync_times": 0,
+            "wecom_tag_sync_result": "",
+        }
+
     def sync_contacts(self):
         """
         同步通讯录
@@ -412,6 +501,86 @@ Synchronize Wecom tag results:
         if result["wecom_tag_sync_state"] == "fail":
             return result
 
+        # 记录全量同步时间
+        self.company_id.sudo().write(
+            {"wecom_contacts_last_full_sync": fields.Datetime.now()}
+        )
+        return result
+
+    def is_full_sync_contacts_due(self):
+        """
+        是否需要全量同步通讯录
+        从未全量同步，或距上次全量同步超过应用参数 "contacts_full_sync_interval"(小时)时需要全量同步，参数为0时每次都全量同步
+        """
+        interval = int(
+            self.env["wecom.app_config"].get_param(
+                self.id, "contacts_full_sync_interval", 0
+            )
+            or 0
+        )
+        company = self.company_id
+        if (
+            not interval
+            or not company.wecom_contacts_last_full_sync
+            or not company.wecom_contacts_dept_user_hash
+        ):
+            return True
+        return (
+            company.wecom_contacts_last_full_sync + datetime.timedelta(hours=interval)
+            <= fields.Datetime.now()
+        )
+
+    def reconcile_contacts(self):
+        """
+        增量同步通讯录
+        部门和标签由通讯录回调事件更新，只核对企微成员ID列表，下载有差异的用户
+        """
+        result = {
+            "company_name": self.company_id.name,
+            "sync_state": "completed",
+        }
+        for key, name, msg in [
+            (
+                "wecom_department",
+                "reconcile_department_data",
+                _("Departments are updated by contacts callback events."),
+            ),
+            (
+                "wecom_tag",
+                "reconcile_tag_data",
+                _("Tags are updated by contacts callback events."),
+            ),
+        ]:
+            sync_state, sync_times, sync_result = self.handle_sync_task_state(
+                [{"name": name, "state": True, "time": 0, "msg": msg}],
+                self.company_id,
+            )
+            result.update(
+                {
+                    "%s_sync_state" % key: sync_state,
+                    "%s_sync_times" % key: sync_times,
+                    "%s_sync_result" % key: sync_result,
+                }
+            )
+
+        # 核对企微用户
+        reconcile_user_result = (
+            self.env["wecom.user"]
+            .with_context(company_id=self.company_id)
+            .reconcile_wecom_users()
+        )
+        (
+            wecom_user_sync_state,
+            wecom_user_sync_times,
+            wecom_user_sync_result,
+        ) = self.handle_sync_task_state(reconcile_user_result, self.company_id)
+        result.update(
+            {
+                "wecom_user_sync_state": wecom_user_sync_state,
+                "wecom_user_sync_times": wecom_user_sync_times,
+                "wecom_user_sync_result": wecom_user_sync_result,
+            }
+        )
         return result
 
     def get_state_name(self, key):
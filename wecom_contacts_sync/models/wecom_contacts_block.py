@@ -34,6 +34,47 @@ class WxworkContactsBlock(models.Model):
         ),
     ]
 
+    @api.model
+    def get_blocked_userids(self, company):
+        """
+        获取公司屏蔽的企微用户ID集合，统一转换为小写用于比较
+        """
+        return {
+            block["wecom_userid"].casefold()
+            for block in self.sudo().search_read(
+                [("company_id", "=", company.id)], ["wecom_userid"]
+            )
+        }
+
+    @api.model
+    def filter_userids(self, company, userids, blocked_userids=None):
+        """
+        从企微用户ID列表中移除屏蔽的用户
+        :param blocked_userids: 已获取的屏蔽用户ID集合，为空时查询
+        :returns 新的列表
+        """
+        if blocked_userids is None:
+            blocked_userids = self.get_blocked_userids(company)
+        if not blocked_userids:
+            return list(userids)
+        return [
+            userid for userid in userids if userid.casefold() not in blocked_userids
+        ]
+
+    @api.model
+    def filter_users(self, company, users, key="userid", blocked_userids=None):
+        """
+        从企微用户字典列表中移除屏蔽的用户
+        :param key: 用户ID所在的键
+        :param blocked_userids: 已获取的屏蔽用户ID集合，为空时查询
+        :returns 新的列表
+        """
+        if blocked_userids is None:
+            blocked_userids = self.get_blocked_userids(company)
+        if not blocked_userids:
+            return list(users)
+        return [user for user in users if user[key].casefold() not in blocked_userids]
+
     @api.depends("company_id", "wecom_userid")
     def _compute_name(self):
         for block in self:
@@ -3,6 +3,7 @@
 import logging
 import json
 import time
+from collections import defaultdict
 from odoo import fields, models, api, Command, tools, _
 from odoo.exceptions import UserError
 import xmltodict
@@ -11,6 +12,9 @@ from odoo.addons.base.models.ir_mail_server import MailDeliveryException
 
 _logger = logging.getLogger(__name__)
 
+# 批量创建部门时每批的数量
+DEPARTMENT_BATCH_SIZE = 1000
+
 
 class WecomDepartment(models.Model):
     _name = "wecom.department"
@@ -85,25 +89,59 @@ class WecomDepartment(models.Model):
 
     @api.depends("parentid","company_id")
     def _compute_parent_id(self):
+        parents = self.get_department_map(
+            self.company_id, [department.parentid for department in self]
+        )
         for department in self:
-            if department.parentid:
-                parent_department = self.sudo().search(
-                    [
-                        ("department_id", "=", department.parentid),("company_id", "=", department.company_id.id)
-                    ]
-                )
-                department.parent_id = parent_department.id
+            department.parent_id = parents.get(
+                (department.company_id.id, department.parentid), False
+            )
 
     @api.depends("name", "parent_id","company_id")
     def _compute_complete_name(self):
-        for department in self:
-            if department.parent_id:
-                department.complete_name = "%s / %s" % (
-                    department.parent_id.complete_name,
+        # 自上而下计算，同一批次中的上级部门只计算一次，不在批次中的上级部门使用已保存的值
+        complete_names = {}
+        batch_ids = set(self.ids)
+
+        def get_complete_name(department, path):
+            if department in complete_names:
+                return complete_names[department]
+            parent = department.parent_id
+            if parent.id in batch_ids and parent not in path:
+                complete_name = "%s / %s" % (
+                    get_complete_name(parent, path | {department}),
                     department.name,
                 )
+            elif parent and parent not in path:
+                complete_name = "%s / %s" % (parent.complete_name, department.name)
             else:
-                department.complete_name = department.name
+                complete_name = department.name
+            complete_names[department] = complete_name
+            return complete_name
+
+        for department in self:
+            department.complete_name = get_complete_name(department, {department})
+
+    def get_department_map(self, companies, department_ids=None):
+        """
+        一次查询公司的部门
+        :param department_ids: 企微部门ID列表，为空时查询全部部门
+        :returns {(公司ID, 企微部门ID): 部门}
+        """
+        domain = [("company_id", "in", companies.ids)]
+        if department_ids is not None:
+            department_ids = [
+                department_id for department_id in set(department_ids) if department_id
+            ]
+            if not department_ids:
+                return {}
+            domain.append(("department_id", "in", department_ids))
+        departments = {}
+        for department in self.sudo().search(domain, order="id"):
+            departments.setdefault(
+                (department.company_id.id, department.department_id), department
+            )
+        return departments
 
     # @api.onchange('parent_id')
     # def _onchange_parentid(self):
@@ -175,13 +213,12 @@ class WecomDepartment(models.Model):
                 wecom_departments = response["department_id"]
 
                 # 1.下载部门
-                for wecom_department in wecom_departments:
-                    download_department_result = self.download_department(
-                        company, wecom_department
-                    )
-                    if download_department_result:
-                        for r in download_department_result:
-                            tasks.append(r)  # 加入 下载员工失败结果
+                tasks.extend(
+                    self.download_departments(company, wxapi, wecom_departments)
+                )  # 加入 下载部门失败结果
+
+                # 2.设置上级部门
+                tasks.extend(self.set_parent_department(company))
 
                 # 3.完成
                 end_time = time.time()
@@ -195,142 +232,186 @@ class WecomDepartment(models.Model):
         finally:
             return tasks  # 返回结果
 
-    def download_department(self, company, wecom_department):
+    def download_departments(self, company, wxapi, wecom_departments):
         """
-        下载部门
+        批量下载部门
+        并发获取部门详情，一次查询公司的全部部门，批量创建新部门，只更新有变化的部门
+        获取详情失败的部门使用部门ID列表中的 'id' , 'parentid' , 'order' 字段
+        :param wecom_departments: 获取子部门ID列表接口返回的部门
+        :returns 失败结果列表
         """
-        # 查询数据库是否存在相同的企业微信部门ID，有则更新，无则新建
-        department = self.sudo().search(
+        results = []
+        responses = wxapi.httpCallBatch(
             [
-                ("department_id", "=", wecom_department["id"]),
-                ("company_id", "=", company.id),
-            ],
-            limit=1,
+                (
+                    self.env["wecom.service_api_list"].get_server_api_call(
+                        "DEPARTMENT_DETAILS"
+                    ),
+                    {"id": str(wecom_department["id"])},
+                )
+                for wecom_department in wecom_departments
+            ]
         )
-
-        result = {}        
-
-        if not department:                
-            result = self.create_department(company, department, wecom_department)
-        else:
-            result = self.update_department(company, department, wecom_department)
-        return result
-
-    def create_department(self, company, department, wecom_department):
-        """
-        创建部门
-        """
-        try:
-            department.create(
-                {
-                    "department_id": wecom_department["id"],
+        blocked_userids = self.env["wecom.contacts.block"].get_blocked_userids(
+            company
+        )
+        departments = {
+            department.department_id: department
+            for department in self.sudo().search([("company_id", "=", company.id)])
+        }
+
+        create_vals_list = []
+        for wecom_department, response in zip(wecom_departments, responses):
+            if isinstance(response, ApiException):
+                result = _(
+                    "Error getting company [%s]'s department [%s] details, error reason: %s"
+                ) % (company.name, wecom_department["id"], repr(response))
+                _logger.warning(result)
+                results.append(
+                    {
+                        "name": "get_department_details",
+                        "state": False,
+                        "time": 0,
+                        "msg": result,
+                    }
+                )
+                vals = {
                     "parentid": wecom_department["parentid"],
                     "order": wecom_department["order"],
-                    "company_id": company.id,
                 }
-            )
+            else:
+                vals = self.prepare_department_values(
+                    response["department"], blocked_userids
+                )
 
-        except Exception as e:
-            result = _(
-                "Error creating company [%s]'s department [%s], error reason: %s"
-            ) % (
-                company.name,
-                wecom_department["id"],
-                repr(e),
-            )
-            _logger.warning(result)
-            return {
-                "name": "add_department",
-                "state": False,
-                "time": 0,
-                "msg": result,
-            }
+            department = departments.get(wecom_department["id"])
+            if not department:
+                vals.update(
+                    {"department_id": wecom_department["id"], "company_id": company.id}
+                )
+                create_vals_list.append(vals)
+            elif any(
+                department[field] != value
+                for field, value in vals.items()
+                if field != "name"
+            ):
+                try:
+                    with self.env.cr.savepoint():
+                        department.write(vals)
+                except Exception as e:
+                    result = _(
+                        "Error update company [%s]'s Department [%s], error reason: %s"
+                    ) % (company.name, wecom_department["id"], repr(e))
+                    _logger.warning(result)
+                    results.append(
+                        {
+                            "name": "update_department",
+                            "state": False,
+                            "time": 0,
+                            "msg": result,
+                        }
+                    )
 
-    def update_department(self, company, department, wecom_department):
+        for vals_list in tools.split_every(
+            DEPARTMENT_BATCH_SIZE, create_vals_list, list
+        ):
+            try:
+                with self.env.cr.savepoint():
+                    self.sudo().create(vals_list)
+            except Exception:
+                for vals in vals_list:
+                    try:
+                        with self.env.cr.savepoint():
+                            self.sudo().create(vals)
+                    except Exception as e:
+                        result = _(
+                            "Error creating company [%s]'s department [%s], error reason: %s"
+                        ) % (company.name, vals["department_id"], repr(e))
+                        _logger.warning(result)
+                        results.append(
+                            {
+                                "name": "add_department",
+                                "state": False,
+                                "time": 0,
+                                "msg": result,
+                            }
+                        )
+        return results
+
+    def prepare_department_values(self, department, blocked_userids=None):
         """
-        更新部门
+        将企微部门详情转换为 wecom.department 的字段值
+        :param department: 获取单个部门详情接口返回的部门
+        :param blocked_userids: 屏蔽的用户ID集合，从部门负责人中移除
         """
-        try:
-            department.write(
-                {
-                    "parentid": wecom_department["parentid"],
-                    "order": wecom_department["order"],
-                }
-            )
-        except Exception as e:
-            result = _("Error updating Department [%s], error details:%s") % (
-                wecom_department["name"],
-                str(e),
-            )
-            result = _(
-                "Error update company [%s]'s Department [%s], error reason: %s"
-            ) % (
-                company.name,
-                wecom_department["id"],
-                repr(e),
-            )
-            _logger.warning(result)
-            return {
-                "name": "update_department",
-                "state": False,
-                "time": 0,
-                "msg": result,
-            }
+        if blocked_userids and department.get("department_leader"):
+            department["department_leader"] = [
+                userid
+                for userid in department["department_leader"]
+                if userid.casefold() not in blocked_userids
+            ]
+        for key in department.keys():
+            if type(department[key]) in (list, dict) and department[key]:
+                json_str = json.dumps(
+                    department[key],
+                    sort_keys=False,
+                    indent=2,
+                    separators=(",", ":"),
+                    ensure_ascii=False,
+                )
+                department[key] = json_str
+        return {
+            "name": department["name"],
+            "name_en": self.env["wecom.tools"].check_dictionary_keywords(
+                department, "name_en"
+            ),
+            "department_leader": str(department.get("department_leader") or "[]"),
+            "parentid": department["parentid"],
+            "order": department["order"],
+        }
 
     def set_parent_department(self, company):
         """[summary]
         由于json数据是无序的，故在同步到本地数据库后，需要设置新增企业微信部门的上级部门
+        一次加载公司的全部部门，在内存中解析上级部门，按上级部门分组写入，
+        部门全称在写入后的一次重新计算中自上而下生成
         """
         params = self.env["ir.config_parameter"].sudo()
         debug = params.get_param("wecom.debug_enabled")
 
-        departments = self.search([("company_id", "=", company.id)])
+        departments = self.get_department_map(company)
 
-        results = []
-        for department in departments:
+        groups = defaultdict(list)
+        for department in departments.values():
             if department.parentid and department.parentid != 0:
                 # 忽略 parentid 为 0的部门
-                parent_department = self.get_parent_department_by_department_id(
-                    department, company
+                parent_department = departments.get(
+                    (company.id, department.parentid), self.browse()
                 )
+                if department.parent_id != parent_department:
+                    groups[parent_department.id].append(department.id)
 
-                try:
-                    department.write(
-                        {
-                            "parent_id": parent_department.id,
-                        }
-                    )
-                except Exception as e:
-                    result = _(
-                        "Error setting parent department for company [%s], Error details:%s"
-                    ) % (company.name, repr(e))
-                    if debug:
-                        _logger.warning(result)
-                    results.append(
-                        {
-                            "name": "set_parent_department",
-                            "state": False,
-                            "time": 0,
-                            "msg": result,
-                        }
-                    )
+        results = []
+        for parent_id, department_ids in groups.items():
+            try:
+                with self.env.cr.savepoint():
+                    self.browse(department_ids).write({"parent_id": parent_id})
+            except Exception as e:
+                result = _(
+                    "Error setting parent department for company [%s], Error details:%s"
+                ) % (company.name, repr(e))
+                if debug:
+                    _logger.warning(result)
+                results.append(
+                    {
+                        "name": "set_parent_department",
+                        "state": False,
+                        "time": 0,
+                        "msg": result,
+                    }
+                )
         return results  # 返回失败的结果
 
-    def get_parent_department_by_department_id(self, department, company):
-        """[summary]
-        通过企微部门id 获取上级部门
-        Args:
-            department ([type]): [description]
-            departments ([type]): [descriptions]
-        """
-        parent_department = self.search(
-            [
-                ("department_id", "=", department.parentid),
-                ("company_id", "=", company.id),
-            ]
-        )
-        return parent_department
-
     def download_single_department(self):
         """
         下载单个部门
@@ -348,27 +429,11 @@ class WecomDepartment(models.Model):
                 ),
                 {"id": str(self.department_id)},
             )
-            department = response["department"]
-            for key in department.keys():
-                if type(department[key]) in (list, dict) and department[key]:
-                    json_str = json.dumps(
-                        department[key],
-                        sort_keys=False,
-                        indent=2,
-                        separators=(",", ":"),
-                        ensure_ascii=False,
-                    )
-                    department[key] = json_str
             self.sudo().write(
-                {
-                    "name": department["name"],
-                    "name_en": self.env["wecom.tools"].check_dictionary_keywords(
-                        department, "name_en"
-                    ),
-                    "department_leader": department["department_leader"],
-                    "parentid": department["parentid"],
-                    "order": department["order"],
-                }
+                self.prepare_department_values(
+                    response["department"],
+                    self.env["wecom.contacts.block"].get_blocked_userids(company),
+                )
             )
         except ApiException as ex:
             message = _("Department [id:%s, name:%s] failed to download,Reason: %s") % (
@@ -95,13 +95,44 @@ class WecomTag(models.Model):
             ]
         else:
             wecom_tags = response["taglist"]  # 列表类型数据
+            blocked_userids = self.env["wecom.contacts.block"].get_blocked_userids(
+                company
+            )
+
+            # 并发获取所有标签的成员
+            member_responses = wxapi.httpCallBatch(
+                [
+                    (
+                        self.env["wecom.service_api_list"].get_server_api_call(
+                            "TAG_GET_MEMBER"
+                        ),
+                        {"tagid": str(wecom_tag["tagid"])},
+                    )
+                    for wecom_tag in wecom_tags
+                ]
+            )
+            tags = {
+                tag.tagid: tag
+                for tag in self.sudo().search(
+                    [
+                        ("tagid", "in", [wecom_tag["tagid"] for wecom_tag in wecom_tags]),
+                        ("company_id", "=", company.id),
+                    ],
+                    order="id desc",
+                )
+            }
 
             # 下载标签
-            for wecom_tag in wecom_tags:
-                download_tag_result = self.download_tag(company, wecom_tag)
+            for wecom_tag, member_response in zip(wecom_tags, member_responses):
+                download_tag_result = self.download_tag(
+                    company,
+                    wecom_tag,
+                    blocked_userids,
+                    member_response,
+                    tags.get(wecom_tag["tagid"], self.sudo().browse()),
+                )
                 if download_tag_result:
-                    for r in download_tag_result:
-                        tasks.append(r)  # 加入 下载标签失败结果
+                    tasks.append(download_tag_result)  # 加入 下载标签失败结果
             end_time = time.time()
             task = {
                 "name": "download_tag_data",
@@ -113,27 +144,40 @@ class WecomTag(models.Model):
         finally:
             return tasks  # 返回结果
 
-    def download_tag(self, company, wecom_tag):
+    def download_tag(
+        self, company, wecom_tag, blocked_userids=None, response=None, tag=None
+    ):
         """
         下载标签
+        :param blocked_userids: 屏蔽的企微用户ID集合
+        :param response: 已获取的 TAG_GET_MEMBER 结果，为空时调用API获取
+        :param tag: 已查询的本地标签，为 None 时查询
+        :returns 失败结果
         """
-        tag = self.sudo().search(
-            [("tagid", "=", wecom_tag["tagid"]), ("company_id", "=", company.id),],
-            limit=1,
-        )
+        if tag is None:
+            tag = self.sudo().search(
+                [("tagid", "=", wecom_tag["tagid"]), ("company_id", "=", company.id),],
+                limit=1,
+            )
         result = {}
         try:
-            wxapi = self.env["wecom.service_api"].InitServiceApi(
-                company.corpid, company.contacts_app_id.secret
-            )
-
-            response = wxapi.httpCall(
-                self.env["wecom.service_api_list"].get_server_api_call(
-                    "TAG_GET_MEMBER"
-                ),
-                {"tagid": str(wecom_tag["tagid"])},
+            if response is None:
+                wxapi = self.env["wecom.service_api"].InitServiceApi(
+                    company.corpid, company.contacts_app_id.secret
+                )
+                response = wxapi.httpCall(
+                    self.env["wecom.service_api_list"].get_server_api_call(
+                        "TAG_GET_MEMBER"
+                    ),
+                    {"tagid": str(wecom_tag["tagid"])},
+                )
+            elif isinstance(response, ApiException):
+                raise response
+            response["userlist"] = self.env["wecom.contacts.block"].filter_userids(
+                company,
+                [user["userid"] for user in response["userlist"]],
+                blocked_userids,
             )
-            response["userlist"] = [user["userid"] for user in response["userlist"]]
             wecom_tag.update(
                 {
                     "userlist": self.env["wecom.tools"].check_dictionary_keywords(
@@ -145,16 +189,17 @@ class WecomTag(models.Model):
                 }
             )
 
-        except ApiException as ex:
-            result = _(
-                "Wecom API acquisition company[%s]'s tag [id:%s] member failed, error details: %s"
-            ) % (company.name, wecom_tag["tagid"], str(ex))
-            _logger.warning(result)
         except Exception as e:
-            result = _(
+            msg = _(
                 "Wecom API acquisition company[%s]'s tag [id:%s] member failed, error details: %s"
             ) % (company.name, wecom_tag["tagid"], str(e))
-            _logger.warning(result)
+            _logger.warning(msg)
+            result = {
+                "name": "download_tag_members",
+                "state": False,
+                "time": 0,
+                "msg": msg,
+            }  # 返回失败结果
         else:
             for key in wecom_tag.keys():
                 if type(wecom_tag[key]) in (list, dict) and wecom_tag[key]:
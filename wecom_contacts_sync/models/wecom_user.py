@@ -2,6 +2,7 @@
 
 from asyncio.windows_events import NULL
 import logging
+import hashlib
 import json
 from collections import defaultdict
 import time
@@ -13,6 +14,11 @@ from odoo.addons.base.models.ir_mail_server import MailDeliveryException
 
 _logger = logging.getLogger(__name__)
 
+# 批量创建用户时每批的数量
+USER_BATCH_SIZE = 1000
+# 获取成员ID列表每页的数量
+USER_LIST_PAGE_SIZE = 10000
+
 
 class WecomUser(models.Model):
     _name = "wecom.user"
@@ -165,16 +171,29 @@ class WecomUser(models.Model):
 
     @api.depends("main_department")
     def _compute_department_id(self):
-        for user in self:
-            department_id = self.env["wecom.department"].search(
+        keys = {
+            (user.company_id.id, int(user.main_department))
+            for user in self
+            if user.main_department and user.main_department.isdigit()
+        }
+        departments = {}
+        if keys:
+            for department in self.env["wecom.department"].search(
                 [
-                    ("department_id", "=", user.main_department),
-                    ("company_id", "=", user.company_id.id),
-                ],
-                limit=1,
+                    ("company_id", "in", list({key[0] for key in keys})),
+                    ("department_id", "in", list({key[1] for key in keys})),
+                ]
+            ):
+                departments.setdefault(
+                    (department.company_id.id, department.department_id), department.id
+                )
+        for user in self:
+            key = (
+                (user.company_id.id, int(user.main_department))
+                if user.main_department and user.main_department.isdigit()
+                else None
             )
-            if department_id:
-                user.department_id = department_id
+            user.department_id = departments.get(key, False)
 
     @api.depends("gender")
     def _compute_gender_name(self):
@@ -232,17 +251,7 @@ class WecomUser(models.Model):
                 company.corpid, company.contacts_app_id.secret
             )
 
-            # 2020-8-27 按照官方API要求，进行重构
-            # json对象只有 userid 和 department 两个字段
-            # 参数："cursor", 必须:否, 说明:用于分页查询的游标，字符串类型，由上一次调用返回，首次调用不填
-            # 参数："limit", 必须:否, 说明:分页，预期请求的数据量，取值范围 1 ~ 10000
-
-            response = wxapi.httpCall(
-                self.env["wecom.service_api_list"].get_server_api_call("USER_LIST_ID"),
-                {}
-                # {"department_id": "1", "fetch_child": "1",},
-            )
-            
+            userlist = self.get_wecom_userlist(wxapi)
         except ApiException as ex:
             end_time = time.time()
 
@@ -268,77 +277,342 @@ class WecomUser(models.Model):
                 }
             ]
         else:
-            # response["userlist"] 只含  'department', 'userid' 2个字段
-            if response["errcode"] == 0:
-                # 1. 合并多部门
-                dept_user = response["dept_user"]
-                d = defaultdict(lambda : defaultdict(list))
-                for dic in dept_user:
-                    userid, department = dic["userid"], dic["department"]
-                    d[userid]["userid"] = userid
-                    d[userid]["department"].extend(str(department))
-
-                userlist = []
-                for key, value in d.items():
-                    dept_user = {}
-                    department = []
-                    userid = value["userid"]
-                    departments = value["department"]
-                    for dep in departments:
-                        department.append(int(dep))
-                    userlist.append({"userid": userid, "department": department})
-
-                # 2. 处理 block
-                blocks = (
-                    self.env["wecom.contacts.block"]
-                    .sudo()
-                    .search([("company_id", "=", company.id),])
+            # 1. 处理 block，从 userlist 移除 blocklist
+            userlist = self.env["wecom.contacts.block"].filter_users(company, userlist)
+            # 2.下载用户
+            if userlist:
+                tasks.extend(self.download_users(company, userlist))  # 加入 下载用户失败结果
+
+            # 3.记录成员ID列表的摘要，供增量同步比较
+            if not tasks:
+                company.sudo().write(
+                    {"wecom_contacts_dept_user_hash": self.get_userlist_hash(userlist)}
                 )
 
-                if blocks:
-                    for block in blocks:
-                        for item in userlist:
-                            if item["userid"].lower() == block.wecom_userid.lower():
-                                # 从 userlist 移除 blocklist
-                                userlist.remove(item)
-                # 3.下载用户
-                if userlist:
-                    for wecom_user in userlist:
-                        download_user_result = self.download_user(company, wecom_user)
-                        if download_user_result:
-                            for r in download_user_result:
-                                tasks.append(r)  # 加入 下载员工失败结果
-
-                # 4.完成下载
-                end_time = time.time()
-                task = {
-                    "name": "download_user_data",
+            # 4.完成下载
+            end_time = time.time()
+            task = {
+                "name": "download_user_data",
+                "state": True,
+                "time": end_time - start_time,
+                "msg": _("User list sync completed."),
+            }
+            tasks.append(task)
+        finally:
+            return tasks  # 返回结果
+
+    def get_wecom_userlist(self, wxapi):
+        """
+        获取企微成员ID列表，合并多部门
+        按 next_cursor 逐页获取完整的列表，任一页失败或游标不前进时抛出异常，避免按不完整的列表停用成员
+        :param wxapi: 通讯录应用的API实例
+        :returns [{"userid": userid, "department": [部门ID, ...]}, ...]
+        """
+        # 2020-8-27 按照官方API要求，进行重构
+        # json对象只有 userid 和 department 两个字段
+        # 参数："cursor", 必须:否, 说明:用于分页查询的游标，字符串类型，由上一次调用返回，首次调用不填
+        # 参数："limit", 必须:否, 说明:分页，预期请求的数据量，取值范围 1 ~ 10000
+        api_call = self.env["wecom.service_api_list"].get_server_api_call(
+            "USER_LIST_ID"
+        )
+        departments = defaultdict(list)
+        cursor = ""
+        cursors = set()
+        while True:
+            params = {"limit": USER_LIST_PAGE_SIZE}
+            if cursor:
+                params["cursor"] = cursor
+            response = wxapi.httpCall(api_call, params)
+
+            # response["dept_user"] 只含  'department', 'userid' 2个字段，每个部门一行
+            for dic in response.get("dept_user", []):
+                departments[dic["userid"]].append(int(dic["department"]))
+
+            cursor = response.get("next_cursor")
+            if not cursor:
+                break
+            if cursor in cursors:
+                raise UserError(
+                    _("The member ID list of WeCom is incomplete, paging cursor: %s")
+                    % cursor
+                )
+            cursors.add(cursor)
+        return [
+            {"userid": userid, "department": department}
+            for userid, department in departments.items()
+        ]
+
+    def format_department_ids(self, department_ids):
+        """
+        将成员的部门ID列表转换为保存的格式
+        部门ID排序后保存，不同接口、回调返回的部门顺序不同时结果一致，便于增量同步比较
+        :param department_ids: 部门ID列表
+        :returns 字符串，例如 "[1, 2]"
+        """
+        return str(sorted(int(department_id) for department_id in department_ids))
+
+    def get_userlist_hash(self, userlist):
+        """
+        计算成员ID列表的摘要，与成员的顺序无关
+        :param userlist: [{"userid": userid, "department": [部门ID, ...]}, ...]
+        """
+        data = sorted(
+            [user["userid"], self.format_department_ids(user["department"])]
+            for user in userlist
+        )
+        return hashlib.sha1(
+            json.dumps(data, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
+    @api.model
+    def reconcile_wecom_users(self):
+        """
+        增量同步用户
+        成员的变更由通讯录回调事件实时更新，此处只做定期核对：
+        企微成员ID列表的摘要与上次同步相同时不做任何处理；
+        否则只下载 userid 或部门与本地不同的用户，并停用企微中已不存在的用户
+        """
+        start_time = time.time()
+
+        company = self.env.context.get("company_id")
+        if type(company) == int:
+            company = self.env["res.company"].browse(company)
+
+        tasks = []
+        try:
+            wxapi = self.env["wecom.service_api"].InitServiceApi(
+                company.corpid, company.contacts_app_id.secret
+            )
+            userlist = self.get_wecom_userlist(wxapi)
+        except Exception as e:
+            end_time = time.time()
+            tasks = [
+                {
+                    "name": "reconcile_user_data",
+                    "state": False,
+                    "time": end_time - start_time,
+                    "msg": str(e),
+                }
+            ]
+        else:
+            wecom_userids = {user["userid"] for user in userlist}
+            userlist = self.env["wecom.contacts.block"].filter_users(company, userlist)
+            userlist_hash = self.get_userlist_hash(userlist)
+
+            if userlist_hash == company.wecom_contacts_dept_user_hash:
+                msg = _("User list has not changed.")
+            else:
+                users = {
+                    user.userid: user
+                    for user in self.sudo()
+                    .with_context(active_test=False)
+                    .search([("company_id", "=", company.id)])
+                }
+                changed_userlist = [
+                    wecom_user
+                    for wecom_user in userlist
+                    if wecom_user["userid"] not in users
+                    or not users[wecom_user["userid"]].active
+                    or users[wecom_user["userid"]].department
+                    != self.format_department_ids(wecom_user["department"])
+                ]
+                removed_users = self.sudo().browse(
+                    [
+                        user.id
+                        for userid, user in users.items()
+                        if user.active and userid not in wecom_userids
+                    ]
+                )
+
+                if changed_userlist:
+                    tasks.extend(self.download_users(company, changed_userlist))
+                    tasks.extend(
+                        self.download_user_details(
+                            company,
+                            wxapi,
+                            [wecom_user["userid"] for wecom_user in changed_userlist],
+                        )
+                    )
+                if removed_users:
+                    removed_users.write({"active": False})
+
+                if not tasks:
+                    company.sudo().write(
+                        {"wecom_contacts_dept_user_hash": userlist_hash}
+                    )
+                msg = _(
+                    "User list reconciled, %s users downloaded, %s users deactivated."
+                ) % (len(changed_userlist), len(removed_users))
+
+            end_time = time.time()
+            tasks.append(
+                {
+                    "name": "reconcile_user_data",
                     "state": True,
                     "time": end_time - start_time,
-                    "msg": _("User list sync completed."),
+                    "msg": msg,
                 }
-                tasks.append(task)
+            )
         finally:
             return tasks  # 返回结果
 
-    def download_user(self, company, wecom_user):
+    def download_user_details(self, company, wxapi, userids):
         """
-        下载用户
+        并发下载用户详情
+        :returns 失败结果列表
         """
-        user = self.sudo().search(
+        results = []
+        users = {
+            user.userid: user
+            for user in self.sudo()
+            .with_context(active_test=False)
+            .search([("company_id", "=", company.id), ("userid", "in", userids)])
+        }
+        responses = wxapi.httpCallBatch(
             [
-                ("userid", "=", wecom_user["userid"]),
-                ("company_id", "=", company.id),
-            ],
-            limit=1,
+                (
+                    self.env["wecom.service_api_list"].get_server_api_call("USER_GET"),
+                    {"userid": userid},
+                )
+                for userid in userids
+            ]
         )
-   
-        result = {}
-        if not user:
-            result = self.create_user(company, user, wecom_user)
-        else:
-            result = self.update_user(company, user, wecom_user)
-        return result
+        for userid, response in zip(userids, responses):
+            user = users.get(userid)
+            if not user:
+                continue
+            try:
+                if isinstance(response, ApiException):
+                    raise response
+                with self.env.cr.savepoint():
+                    vals = self.prepare_user_values(response)
+                    vals["active"] = True
+                    user.write(vals)
+            except Exception as e:
+                result = _(
+                    "Error update company [%s]'s user [%s], error reason: %s"
+                ) % (company.name, userid, repr(e))
+                _logger.warning(result)
+                results.append(
+                    {
+                        "name": "update_user",
+                        "state": False,
+                        "time": 0,
+                        "msg": result,
+                    }
+                )
+        return results
+
+    def prepare_user_values(self, response):
+        """
+        将企微成员详情转换为 wecom.user 的字段值
+        :param response: 读取成员接口的响应
+        """
+        # 部门与成员ID列表保存的格式一致，便于增量同步比较
+        department = self.format_department_ids(response["department"])
+        for key in response.keys():
+            if type(response[key]) in (list, dict) and response[key]:
+                json_str = json.dumps(
+                    response[key],
+                    sort_keys=False,
+                    indent=2,
+                    separators=(",", ":"),
+                    ensure_ascii=False,
+                )
+                response[key] = json_str
+        return {
+            "name": response["name"],
+            "english_name": self.env["wecom.tools"].check_dictionary_keywords(
+                response, "english_name"
+            ),
+            "mobile": response["mobile"],
+            "department": department,
+            "main_department": response["main_department"],
+            "order": response["order"],
+            "position": response["position"],
+            "gender": response["gender"],
+            "email": response["email"],
+            "biz_mail": response["biz_mail"],
+            "is_leader_in_dept": response["is_leader_in_dept"],
+            "direct_leader": response["direct_leader"],
+            "avatar": response["avatar"],
+            "thumb_avatar": response["thumb_avatar"],
+            "telephone": response["telephone"],
+            "alias": response["alias"],
+            "extattr": response["extattr"],
+            "external_profile": self.env["wecom.tools"].check_dictionary_keywords(
+                response, "external_profile"
+            ),
+            "external_position": self.env["wecom.tools"].check_dictionary_keywords(
+                response, "external_position"
+            ),
+            "status": response["status"],
+            "qr_code": response["qr_code"],
+            "address": self.env["wecom.tools"].check_dictionary_keywords(
+                response, "address"
+            ),
+            "open_userid": self.env["wecom.tools"].check_dictionary_keywords(
+                response, "open_userid"
+            ),
+        }
+
+    def download_users(self, company, wecom_users):
+        """
+        批量下载用户
+        一次查询公司的全部用户，在内存中比较差异后，批量创建新用户，按部门分组批量更新已有用户
+        企业微信仍返回的已归档用户重新启用
+        批量操作失败时，逐个创建或更新以记录失败的用户
+        :returns 失败结果列表
+        """
+        results = []
+        users = {
+            user.userid: user
+            for user in self.sudo()
+            .with_context(active_test=False)
+            .search([("company_id", "=", company.id)])
+        }
+
+        create_vals_list = []
+        write_groups = defaultdict(list)
+        for wecom_user in wecom_users:
+            department = self.format_department_ids(wecom_user["department"])
+            user = users.get(wecom_user["userid"])
+            if not user:
+                create_vals_list.append(
+                    {
+                        "userid": wecom_user["userid"],
+                        "department": department,
+                        "company_id": company.id,
+                    }
+                )
+            elif user.department != department or not user.active:
+                write_groups[department].append(user.id)
+
+        for vals_list in tools.split_every(USER_BATCH_SIZE, create_vals_list, list):
+            try:
+                with self.env.cr.savepoint():
+                    self.sudo().create(vals_list)
+            except Exception:
+                for vals in vals_list:
+                    result = self.create_user(company, self.sudo().browse(), vals)
+                    if result:
+                        results.append(result)
+
+        for department, user_ids in write_groups.items():
+            group_users = self.sudo().browse(user_ids)
+            try:
+                with self.env.cr.savepoint():
+                    group_users.write({"department": department, "active": True})
+            except Exception:
+                for user in group_users:
+                    result = self.update_user(
+                        company,
+                        user,
+                        {"userid": user.userid, "department": department},
+                    )
+                    if result:
+                        results.append(result)
+        return results
 
     def create_user(self, company, user, wecom_user):
         """
@@ -356,7 +630,7 @@ class WecomUser(models.Model):
             result = _(
                 "Error creating company [%s]'s user [%s], error reason: %s"
             ) % (
-                company.userid,
+                company.name,
                 wecom_user["userid"].lower(),
                 repr(e),
             )
@@ -377,6 +651,7 @@ class WecomUser(models.Model):
             user.sudo().write(
                 {
                     "department": wecom_user["department"],
+                    "active": True,
                 }
             )
 
@@ -409,53 +684,7 @@ class WecomUser(models.Model):
                 self.env["wecom.service_api_list"].get_server_api_call("USER_GET"),
                 {"userid": self.userid},
             )
-            for key in response.keys():
-                if type(response[key]) in (list, dict) and response[key]:
-                    json_str = json.dumps(
-                        response[key],
-                        sort_keys=False,
-                        indent=2,
-                        separators=(",", ":"),
-                        ensure_ascii=False,
-                    )
-                    response[key] = json_str
-            self.write(
-                {
-                    "name": response["name"],
-                    "english_name": self.env["wecom.tools"].check_dictionary_keywords(
-                        response, "english_name"
-                    ),
-                    "mobile": response["mobile"],
-                    "department": response["department"],
-                    "main_department": response["main_department"],
-                    "order": response["order"],
-                    "position": response["position"],
-                    "gender": response["gender"],
-                    "email": response["email"],
-                    "biz_mail": response["biz_mail"],
-                    "is_leader_in_dept": response["is_leader_in_dept"],
-                    "direct_leader": response["direct_leader"],
-                    "avatar": response["avatar"],
-                    "thumb_avatar": response["thumb_avatar"],
-                    "telephone": response["telephone"],
-                    "alias": response["alias"],
-                    "extattr": response["extattr"],
-                    "external_profile": self.env[
-                        "wecom.tools"
-                    ].check_dictionary_keywords(response, "external_profile"),
-                    "external_position": self.env[
-                        "wecom.tools"
-                    ].check_dictionary_keywords(response, "external_position"),
-                    "status": response["status"],
-                    "qr_code": response["qr_code"],
-                    "address": self.env["wecom.tools"].check_dictionary_keywords(
-                        response, "address"
-                    ),
-                    "open_userid": self.env["wecom.tools"].check_dictionary_keywords(
-                        response, "open_userid"
-                    ),
-                }
-            )
+            self.write(self.prepare_user_values(response))
         except ApiException as ex:
             message = _("User [id:%s, name:%s] failed to download,Reason: %s") % (
                 self.userid,
@@ -530,25 +759,32 @@ class WecomUser(models.Model):
         company_id = self.env.context.get("company_id")
         user_dict = xmltodict.parse(xml_tree)["xml"]
         # print("wecom_event_change_contact_user", user_dict)
-        domain = [
-            "|",
-            ("active", "=", True),
-            ("active", "=", False),
-        ]
-
-        users = self.sudo().search([("company_id", "=", company_id.id)] + domain)
-        callback_user = users.search(
-            [("userid", "=", user_dict["UserID"])],
-            limit=1,
+        # 包含已归档的成员，用于退出企业微信又重新加入的员工
+        callback_user = (
+            self.sudo()
+            .with_context(active_test=False)
+            .search(
+                [
+                    ("company_id", "=", company_id.id),
+                    ("userid", "=", user_dict["UserID"]),
+                ],
+                limit=1,
+            )
         )
 
         if callback_user:
             # 如果存在，则更新
             # 用于退出企业微信又重新加入企业微信的员工
-            cmd = "update"
-        else:
-            # 如果不存在，停止
+            if cmd == "create":
+                cmd = "update"
+        elif cmd == "delete" or not self.env["wecom.contacts.block"].filter_userids(
+            company_id, [user_dict["UserID"]]
+        ):
+            # 如果不存在或在黑名单中，停止
             return
+        else:
+            # 如果不存在，则创建，增量同步依赖回调事件更新成员
+            cmd = "create"
 
         update_dict = {}
 
@@ -564,12 +800,22 @@ class WecomUser(models.Model):
                     update_dict.update({"direct_leader": value})
                 elif key == "BizMail":
                     update_dict.update({"biz_mail": value})
+        if "department" in update_dict:
+            # 回调的部门为逗号分隔的字符串，转换为与成员ID列表一致的格式
+            update_dict.update(
+                {
+                    "department": self.format_department_ids(
+                        dep for dep in update_dict["department"].split(",") if dep
+                    )
+                }
+            )
         if cmd == "create":
             update_dict.update({"company_id": company_id.id})
             callback_user.create(update_dict)
         elif cmd == "update":
             if "userid" in update_dict:
                 del update_dict["userid"]
+            update_dict.update({"active": True})
             callback_user.write(update_dict)
         elif cmd == "delete":
             callback_user.write(
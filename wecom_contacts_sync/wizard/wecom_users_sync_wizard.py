@@ -181,13 +181,10 @@ class WecomUsersSyncWizard(models.TransientModel):
         employees = self.env["hr.employee"].search(
             [("company_id", "=", company.id), ("is_wecom_user", "=", True),]
         )
-        # 创建用户
-        results = []
-        for employee in employees:
-            # 遍历员工
-            result = self.create_user_from_employee(employee, send_mail, send_message)
-            results.append(result)
-        return results
+        # 批量创建用户
+        return self.env["res.users"]._create_users_by_wecom_employees(
+            employees, send_mail, send_message
+        )
 
     def create_user_from_employee(self, employee, send_mail, send_message):
         """
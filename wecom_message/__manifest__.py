@@ -22,6 +22,7 @@
         "security/wecom_message_security.xml",
         "security/ir.model.access.csv",
         "data/ir_config_parameter.xml",
+        "data/ir_cron_data.xml",
         "data/wecom_apps_data.xml",
         "data/auth_signup_message_template_data.xml",
         "data/auth_totp_message_template_data.xml",
@@ -6,6 +6,7 @@ from . import res_company
 from . import res_config_settings
 
 # mail models
+from . import mail_render_mixin
 from . import mail_activity
 from . import mail_template
 from . import mail_mail
@@ -2,6 +2,8 @@
 
 import logging
 import logging
+import threading
+from collections import defaultdict
 from odoo import _, api, fields, models
 from odoo import tools
 from odoo.addons.base.models.ir_mail_server import MailDeliveryException
@@ -10,6 +12,12 @@ from odoo.addons.wecom_api.api.wecom_abstract_api import ApiException
 
 _logger = logging.getLogger(__name__)
 
+# 企业微信消息队列每次处理的数量和失败重试次数
+WECOM_QUEUE_LIMIT = 10000
+WECOM_MAX_RETRIES = 3
+# 每批合并发送的企业微信消息数
+WECOM_SEND_BATCH_SIZE = 500
+
 
 class MailMail(models.Model):
     _inherit = "mail.mail"
@@ -98,6 +106,12 @@ class MailMail(models.Model):
             ("wecom_recall", "Recall"),
         ]
     )
+    wecom_company_id = fields.Many2one(
+        "res.company", string="WeCom message company", copy=False
+    )
+    wecom_retry_count = fields.Integer(
+        string="WeCom message retry count", default=0, copy=False
+    )
 
     @api.model_create_multi
     def create(self, values_list):
@@ -115,6 +129,7 @@ class MailMail(models.Model):
         撤回应用消息
         """
         if self.is_wecom_message:
+            self.mail_message_id._check_wecom_message_recall()
             # 获取公司
             company = self.env[self.model].browse(self.res_id).company_id
             if not company:
@@ -250,7 +265,7 @@ class MailMail(models.Model):
         """
         if not company:
             company = self.env.company
-        for batch_ids in self.ids:
+        for batch_ids in tools.split_every(WECOM_SEND_BATCH_SIZE, self.ids):
             try:
                 WeComMessageApi = self.env["wecom.message.api"].get_message_api(company)
             except ApiException as exc:
@@ -294,16 +309,16 @@ class MailMail(models.Model):
         if not company:
             company = self.env.company
         ApiObj = self.env["wecom.message.api"]
-        for mail_id in self.ids:
-            mail = None
-            try:
-                mail = self.browse(mail_id)
-                if mail.state != "outgoing":
-                    if mail.state != "wecom_exception" and mail.auto_delete:
-                        mail.sudo().unlink()
-                    continue
+        mails = self.browse(self.ids)
+        outgoing_mails = mails.filtered(lambda mail: mail.state == "outgoing")
+        (mails - outgoing_mails).filtered(
+            lambda mail: mail.state != "wecom_exception" and mail.auto_delete
+        ).sudo().unlink()
 
-                # email_list = []
+        msgs = []
+        results = {}
+        for mail in outgoing_mails:
+            try:
                 msg = ApiObj.build_message(
                     msgtype=mail.msgtype,
                     touser=mail.message_to_user,
@@ -322,32 +337,106 @@ class MailMail(models.Model):
                     duplicate_check_interval=mail.duplicate_check_interval,
                     company=company,
                 )
-                del msg["company"]  # 删除message中的 company
-                res = WeComMessageApi.httpCall(
-                    self.env["wecom.service_api_list"].get_server_api_call(
-                        "MESSAGE_SEND"
-                    ),
-                    msg,
-                )
-            except ApiException as exc:
-                error = self.env["wecom.service_api_error"].get_error_by_code(
-                    exc.errCode
-                )
-                self.write(
-                    {
-                        "state": "wecom_exception",
-                        "failure_reason": "%s %s" % (str(error["code"]), error["name"]),
-                    }
-                )
-                if raise_exception:
-                    return self.env["wecomapi.tools.action"].ApiExceptionDialog(
-                        exc, raise_exception
-                    )
-            else:
-                # 如果try中的程序执行过程中没有发生错误，继续执行else中的程序；
-                mail.write(
-                    {"state": "sent", "wecom_message_id": res["msgid"],}
-                )
+            except (ApiException, UserError) as exc:
+                if raise_exception and isinstance(exc, UserError):
+                    raise
+                # 构建失败的消息单独记录异常，不影响其他消息
+                results[mail.id] = exc
+                continue
+            del msg["company"]  # 删除message中的 company
+            msgs.append((mail.id, msg))
+
+        # 内容、类型和选项相同的消息合并接收人后一起发送
+        results.update(ApiObj.send_merged_messages(WeComMessageApi, msgs))
+        first_exc = None
+        vals_groups = defaultdict(list)
+        for mail_id, result in results.items():
+            if isinstance(result, ApiException):
+                first_exc = first_exc or result
+            values = ApiObj.get_send_result_values(result)
+            vals = {
+                "state": "sent" if values["state"] == "sent" else "wecom_exception",
+                "wecom_message_id": values["msgid"],
+                "failure_reason": values["failure_reason"],
+            }
+            vals_groups[tuple(sorted(vals.items()))].append(mail_id)
+        for vals, mail_ids in vals_groups.items():
+            self.browse(mail_ids).write(dict(vals))
+        if auto_commit is True:
+            self._cr.commit()
+        if first_exc and raise_exception:
+            return self.env["wecomapi.tools.action"].ApiExceptionDialog(
+                first_exc, raise_exception
+            )
+        return True
+
+    # ------------------------------------------------------
+    # 企业微信消息队列
+    # ------------------------------------------------------
+
+    @api.model
+    def process_email_queue(self, ids=None):
+        """
+        邮件队列不处理企业微信消息，企业微信消息由 process_wecom_message_queue 发送
+        """
+        filters = list(self._context.get("filters") or [])
+        filters.append(("is_wecom_message", "=", False))
+        return super(MailMail, self.with_context(filters=filters)).process_email_queue(
+            ids=ids
+        )
+
+    @api.model
+    def process_wecom_message_queue(self, ids=None):
+        """
+        发送队列中待发送的企业微信消息，由自动任务调用
+        :param ids: 指定发送的消息，为空时发送所有待发送的消息
+        """
+        filters = [("is_wecom_message", "=", True), ("state", "=", "outgoing")]
+        if ids:
+            filters.append(("id", "in", ids))
+        mails = self.search(filters, order="id", limit=WECOM_QUEUE_LIMIT)
+        # 测试模式下不能提交
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        return mails.send_wecom_outbox(auto_commit=auto_commit)
+
+    def send_wecom_outbox(self, auto_commit=False):
+        """
+        按公司发送企业微信消息，并将发送结果写回 mail.message
+        发送失败的消息重新放入队列，超过重试次数后标记为异常
+        :param bool auto_commit: 每个公司发送后是否提交
+        """
+        mails_by_company = defaultdict(lambda: self.browse())
+        for mail in self:
+            mails_by_company[mail.wecom_company_id or self.env.company] |= mail
+        for company, mails in mails_by_company.items():
+            mails.send_wecom_mail_message(auto_commit=auto_commit, company=company)
+            mails._postprocess_wecom_outbox()
             if auto_commit is True:
                 self._cr.commit()
         return True
+
+    def _postprocess_wecom_outbox(self):
+        """
+        发送后处理：失败重试，将发送状态写回 mail.message，删除发送成功且自动删除的消息
+        """
+        mails = self.exists()
+        retry_mails = mails.filtered(
+            lambda mail: mail.state == "wecom_exception"
+            and mail.wecom_retry_count < WECOM_MAX_RETRIES
+        )
+        for mail in retry_mails:
+            mail.write(
+                {"state": "outgoing", "wecom_retry_count": mail.wecom_retry_count + 1}
+            )
+
+        sent_mails = mails.filtered(lambda mail: mail.state == "sent")
+        sent_mails.mapped("mail_message_id").write(
+            {"state": "sent", "failure_reason": False}
+        )
+        for mail in mails.filtered(lambda mail: mail.state == "wecom_exception") - (
+            retry_mails
+        ):
+            mail.mail_message_id.write(
+                {"state": "exception", "failure_reason": mail.failure_reason}
+            )
+        sent_mails.filtered("auto_delete").sudo().unlink()
@@ -85,7 +85,12 @@ class Message(models.Model):
     )
 
     state = fields.Selection(
-        [("sent", "Sent"), ("exception", "Exception"), ("recall", "Recall"),],
+        [
+            ("outgoing", "Outgoing"),
+            ("sent", "Sent"),
+            ("exception", "Exception"),
+            ("recall", "Recall"),
+        ],
         "Status",
         readonly=True,
         copy=False,
@@ -121,6 +126,7 @@ class Message(models.Model):
         :return:
         """
         if self.is_wecom_message:
+            self._check_wecom_message_recall()
             # 获取公司
             company = self.env[self.model].browse(self.res_id).company_id
             if not company:
@@ -146,6 +152,21 @@ class Message(models.Model):
                 if res["errcode"] == 0:
                     return self.write({"state": "recall", "wecom_message_id": None})
 
+    def _check_wecom_message_recall(self):
+        """
+        检查消息是否可以撤回
+        合并发送的消息共用同一个企业微信消息ID，撤回会影响所有合并的接收人，不允许单独撤回
+        """
+        self.ensure_one()
+        if self.wecom_message_id and self.sudo().search_count(
+            [("wecom_message_id", "=", self.wecom_message_id), ("id", "!=", self.id)]
+        ):
+            raise UserError(
+                _(
+                    "This message was sent together with other messages and cannot be recalled on its own."
+                )
+            )
+
     def resend_message(self):
         """
         重新发送消息
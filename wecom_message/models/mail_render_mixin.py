@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo import _, api, models, tools
+from odoo.exceptions import UserError
+from odoo.tools.rendering_tools import parse_inline_template, render_inline_template
+
+_logger = logging.getLogger(__name__)
+
+
+class MailRenderMixin(models.AbstractModel):
+    _inherit = "mail.render.mixin"
+
+    # ------------------------------------------------------------
+    # 企微消息字段渲染
+    # ------------------------------------------------------------
+
+    def _get_wecom_field_instructions(self, field, lang):
+        """
+        解析模板字段，解析结果按模板源文本缓存
+        模板修改后源文本变化，同一事务中修改后渲染也不会使用过期的解析结果
+        :returns 解析后的模板指令
+        """
+        template_txt = self.with_context(lang=lang)[field]
+        if not template_txt:
+            return ()
+        return self._parse_wecom_template(str(template_txt))
+
+    @api.model
+    @tools.ormcache("template_txt")
+    def _parse_wecom_template(self, template_txt):
+        """
+        解析行内模板，按源文本缓存
+        :returns 解析后的模板指令
+        """
+        return tuple(parse_inline_template(template_txt))
+
+    def _render_wecom_field(self, field, res_ids, post_process=False):
+        """
+        渲染企微消息模板字段
+        行内模板字段使用缓存的解析结果，静态字段直接返回，其他引擎的字段和无权限渲染动态模板时仍由 _render_field 处理
+        :param field: 字段名
+        :param res_ids: 记录ID列表
+        :param post_process: 是否进行后处理（替换本地链接）
+        :returns {记录ID: 渲染结果}
+        """
+        self.ensure_one()
+        engine = getattr(self._fields[field], "render_engine", "inline_template")
+        if engine != "inline_template":
+            return self._render_field(field, res_ids, post_process=post_process)
+
+        instructions = self._get_wecom_field_instructions(
+            field, self._context.get("lang")
+        )
+        is_dynamic = len(instructions) > 1 or bool(
+            instructions and instructions[0][1]
+        )
+        if is_dynamic and not (
+            self._unrestricted_rendering
+            or self.env.is_admin()
+            or self.env.user.has_group("mail.group_mail_template_editor")
+        ):
+            # 由 _render_field 检查权限
+            return self._render_field(field, res_ids, post_process=post_process)
+
+        if not instructions:
+            rendered = dict.fromkeys(res_ids, "")
+        elif not is_dynamic:
+            rendered = dict.fromkeys(res_ids, instructions[0][0])
+        else:
+            rendered = dict.fromkeys(res_ids, "")
+            variables = self._render_eval_context()
+            for record in self.env[self.model].browse(res_ids):
+                variables["object"] = record
+                try:
+                    rendered[record.id] = render_inline_template(
+                        instructions, variables
+                    )
+                except Exception as e:
+                    _logger.info("Failed to render template: %s", e, exc_info=True)
+                    raise UserError(
+                        _("Failed to render template field [%s]: %s") % (field, e)
+                    )
+        if post_process:
+            rendered = self._render_template_postprocess(rendered)
+        return rendered
+
+    @api.model
+    def _postprocess_wecom_values(self, values_list, field, function):
+        """
+        批量处理渲染结果，相同的内容只处理一次
+        :param values_list: 每条记录的值
+        :param field: 字段名
+        :param function: 处理函数，如 tools.html_sanitize
+        """
+        processed = {}
+        for values in values_list:
+            value = values.get(field)
+            if not value:
+                continue
+            if value not in processed:
+                processed[value] = function(value)
+            values[field] = processed[value]
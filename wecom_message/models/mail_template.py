@@ -163,15 +163,15 @@ class MailTemplate(models.Model):
             for field in fields:
                 template = template.with_context(safe=(field == "subject"))
                 if template.msgtype == "mpnews":
-                    generated_field_values = template._render_field(
+                    generated_field_values = template._render_wecom_field(
                         field, template_res_ids, post_process=(field == "body_html")
                     )
                 elif template.msgtype == "markdown":
-                    generated_field_values = template._render_field(
+                    generated_field_values = template._render_wecom_field(
                         field, template_res_ids, post_process=(field == "body_markdown")
                     )
                 else:
-                    generated_field_values = template._render_field(
+                    generated_field_values = template._render_wecom_field(
                         field, template_res_ids, post_process=(field == "body_json"),
                     )
                 for res_id, field_value in generated_field_values.items():
@@ -191,19 +191,20 @@ class MailTemplate(models.Model):
                     results, template_res_ids
                 )
 
-            # 更新所有res_id的值
+            # 更新所有res_id的值，相同的内容只处理一次
+            values_list = [results[res_id] for res_id in template_res_ids]
+            self._postprocess_wecom_values(
+                values_list, "body_html", tools.html_sanitize
+            )
+            # 将HTML转换为纯文本
+            self._postprocess_wecom_values(
+                values_list, "body_json", tools.html2plaintext
+            )
+            self._postprocess_wecom_values(
+                values_list, "body_markdown", tools.html2plaintext
+            )
             for res_id in template_res_ids:
                 values = results[res_id]
-                if values.get("body_html"):
-                    values["body_html"] = tools.html_sanitize(values["body_html"])
-                if values.get("body_json"):
-                    values["body_json"] = tools.html2plaintext(
-                        values["body_json"]
-                    )  # 将HTML转换为纯文本
-                if values.get("body_markdown"):
-                    values["body_markdown"] = tools.html2plaintext(
-                        values["body_markdown"]
-                    )  # 将HTML转换为纯文本
                 # 技术设置
                 values.update(
                     mail_server_id=template.mail_server_id.id or False,
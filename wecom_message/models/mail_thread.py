@@ -4,6 +4,7 @@
 import re
 from email import message
 import logging
+import threading
 from odoo import _, api, exceptions, fields, models, tools, registry, SUPERUSER_ID
 from odoo.addons.wecom_api.api.wecom_abstract_api import ApiException
 
@@ -35,6 +36,7 @@ class MailThread(models.AbstractModel):
      - ``mail_notrack``: 在创建和写入时，不要执行值跟踪创建消息
      - ``tracking_disable``: 在创建和写入时，不执行邮件线程功能（自动订阅、跟踪、发布…）
      - ``mail_notify_force_send``: 如果要发送的电子邮件通知少于50个，请直接发送，而不是使用队列；默认情况下为True
+     - ``wecom_message_defer_trigger``: 企业微信消息入队后不触发发送队列的自动任务，由调用方统一触发
     """
 
     _inherit = "mail.thread"
@@ -83,6 +85,10 @@ class MailThread(models.AbstractModel):
         bus_notifications = []
         inbox_pids = [r["id"] for r in recipients_data if r["notif"] == "inbox"]
         if inbox_pids:
+            # 一次读取所有收件人的企微用户ID
+            partner_wecom_userids = self._get_partner_wecom_userids(
+                [r["id"] for r in recipients_data]
+            )
             notif_create_values = [
                 {
                     "mail_message_id": message.id,
@@ -90,40 +96,45 @@ class MailThread(models.AbstractModel):
                     "notification_type": "inbox",
                     "notification_status": "sent",
                     "is_wecom_message": True
-                    if self.env["res.partner"].browse(pid).wecom_userid
+                    if partner_wecom_userids.get(pid)
                     else False,
                 }
                 for pid in inbox_pids
             ]
 
-            mail_notification = (
-                self.env["mail.notification"].sudo().create(notif_create_values)
-            )
+            self.env["mail.notification"].sudo().create(notif_create_values)
 
+            # 所有收件人共用同一个格式化的消息
             message_format_values = message.message_format()[0]
-            for partner_id in inbox_pids:
+            for partner in self.env["res.partner"].browse(inbox_pids):
                 bus_notifications.append(
-                    (
-                        self.env["res.partner"].browse(partner_id),
-                        "mail.message/inbox",
-                        dict(message_format_values),
-                    )
+                    (partner, "mail.message/inbox", message_format_values)
                 )
-            if mail_notification.is_wecom_message:
+            if any(partner_wecom_userids.get(pid) for pid in inbox_pids):
                 self._notify_record_by_wecom(
-                    message, recipients_data, msg_vals=msg_vals, **kwargs
+                    message,
+                    recipients_data,
+                    msg_vals=msg_vals,
+                    partner_wecom_userids=partner_wecom_userids,
+                    **kwargs
                 )
         if message_sending_method != "1":
             self.env["bus.bus"].sudo()._sendmany(bus_notifications)
 
     def _notify_record_by_wecom(
-        self, message, recipients_data, msg_vals=False, **kwargs
+        self,
+        message,
+        recipients_data,
+        msg_vals=False,
+        partner_wecom_userids=None,
+        **kwargs
     ):
         """
         通过企业微信发送 通知消息
         :param  message: mail.message 记录
         :param list recipients_data: 收件人
         :param dic msg_vals: 消息字典值
+        :param dict partner_wecom_userids: 已读取的收件人企微用户ID {合作伙伴ID: 企微用户ID}
         """
         subject = ""
         if msg_vals:
@@ -133,7 +144,6 @@ class MailThread(models.AbstractModel):
             document_name = Model.browse(msg_vals["res_id"]).name
             msg = self.env["mail.render.mixin"]._replace_local_links(msg_vals["body"])
             company = Model.browse(msg_vals["res_id"]).company_id
-            author_id = msg_vals["author_id"]
             if msg_vals.get("subject"):
                 subject = msg_vals.get("subject")
         else:
@@ -144,14 +154,17 @@ class MailThread(models.AbstractModel):
             msg = self.env["mail.render.mixin"]._replace_local_links(message["body"])
 
             company = Model.browse(message["res_id"]).company_id
-            author_id = message["author_id"].id
             if message["subject"]:
                 subject = message["subject"]
         msg = re.compile(r"<[^>]+>", re.S).sub("", msg)
+        if partner_wecom_userids is None:
+            partner_wecom_userids = self._get_partner_wecom_userids(
+                [r["id"] for r in recipients_data]
+            )
         wecom_userids = [
-            self.env["res.partner"].browse(r["id"]).wecom_userid
+            partner_wecom_userids[r["id"]]
             for r in recipients_data
-            if self.env["res.partner"].browse(r["id"]).wecom_userid
+            if partner_wecom_userids.get(r["id"])
         ]
 
         body_markdown = (
@@ -212,44 +225,79 @@ class MailThread(models.AbstractModel):
 
         if not company:
             company = self.env.company
-        try:
-            wecomapi = self.env["wecom.service_api"].InitServiceApi(
-                company.corpid, company.message_app_id.secret
-            )
-            msg = self.env["wecom.message.api"].build_message(
-                msgtype="markdown",
-                touser="|".join(wecom_userids),
-                toparty="",
-                totag="",
-                subject=subject,
-                media_id=None,
-                description=None,
-                author_id=author_id,
-                body_markdown=body_markdown,
-                safe=True,
-                enable_id_trans=True,
-                enable_duplicate_check=True,
-                duplicate_check_interval=1800,
-                company=company,
-            )
 
-            del msg["company"]
-            res = wecomapi.httpCall(
-                self.env["wecom.service_api_list"].get_server_api_call("MESSAGE_SEND"),
-                msg,
-            )
-        except ApiException as exc:
-            error = self.env["wecom.service_api_error"].get_error_by_code(exc.errCode)
-            message.write(
+        # 消息放入队列，与 message_post 在同一事务中提交，由自动任务发送
+        mail = (
+            self.env["mail.mail"]
+            .sudo()
+            .create(
                 {
-                    "state": "exception",
-                    "failure_reason": "%s %s" % (str(error["code"]), error["name"]),
+                    "mail_message_id": message.id,
+                    "is_notification": True,
+                    "auto_delete": True,
+                    "state": "outgoing",
+                    "wecom_company_id": company.id,
+                    "message_to_user": "|".join(wecom_userids),
+                    "message_to_party": False,
+                    "message_to_tag": False,
+                    "msgtype": "markdown",
+                    "body_markdown": body_markdown,
+                    "safe": "1",
+                    "enable_id_trans": True,
+                    "enable_duplicate_check": True,
+                    "duplicate_check_interval": 1800,
                 }
             )
-        else:
-            message.write(
-                {"state": "sent", "wecom_message_id": res["msgid"],}
+        )
+        message.write({"state": "outgoing"})
+
+        # 接收人少于阈值时，在事务提交后立即发送
+        force_send = self.env.context.get("mail_notify_force_send", True)
+        force_send_limit = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("wecom.message_notify_force_send_limit", 0)
+        )
+        if force_send and len(wecom_userids) < force_send_limit:
+            test_mode = getattr(threading.current_thread(), "testing", False)
+            if test_mode:
+                mail.send_wecom_outbox()
+            else:
+                mail_ids = mail.ids
+                dbname = self.env.cr.dbname
+                _context = self._context
+
+                @self.env.cr.postcommit.add
+                def send_wecom_notifications():
+                    db_registry = registry(dbname)
+                    with db_registry.cursor() as cr:
+                        env = api.Environment(cr, SUPERUSER_ID, _context)
+                        env["mail.mail"].browse(mail_ids).send_wecom_outbox()
+
+        elif not self.env.context.get("wecom_message_defer_trigger"):
+            # 批量发布时由调用方在全部入队后统一触发
+            cron = self.env.ref(
+                "wecom_message.ir_cron_send_wecom_message_queue",
+                raise_if_not_found=False,
             )
+            if cron:
+                cron.sudo()._trigger()
+
+    def _get_partner_wecom_userids(self, partner_ids):
+        """
+        一次读取合作伙伴的企微用户ID
+        :param list partner_ids: 合作伙伴ID列表
+        :returns {合作伙伴ID: 企微用户ID}
+        """
+        if not partner_ids or "wecom_userid" not in self.env["res.partner"]._fields:
+            return {}
+        return {
+            partner["id"]: partner["wecom_userid"]
+            for partner in self.env["res.partner"]
+            .sudo()
+            .with_context(active_test=False)
+            .search_read([("id", "in", list(set(partner_ids)))], ["wecom_userid"])
+        }
 
     # ------------------------------------------------------
     # 关注者API
@@ -9,9 +9,13 @@ from odoo.addons.wecom_api.api.wecom_abstract_api import ApiException
 from datetime import datetime, timedelta
 import pytz
 import json
+from collections import defaultdict
 
 _logger = logging.getLogger(__name__)
 
+# 一次 MESSAGE_SEND 调用的接收人上限: 成员最多1000个，部门最多100个，标签最多100个
+RECIPIENT_LIMITS = (("touser", 1000), ("toparty", 100), ("totag", 100))
+
 
 class WeComMessageApi(models.AbstractModel):
     _name = "wecom.message.api"
@@ -131,6 +135,140 @@ class WeComMessageApi(models.AbstractModel):
             if debug:
                 _logger.warning(_("Error sending message: %s") % (ex))
 
+    def split_recipients(self, recipients):
+        """
+        拆分以'|'分隔的接收人
+        :returns set
+        """
+        return {
+            recipient.strip()
+            for recipient in (recipients or "").split("|")
+            if recipient.strip()
+        }
+
+    def merge_recipients(self, items):
+        """
+        合并相同内容消息的接收人，每组接收人不超过 RECIPIENT_LIMITS
+        单条消息的接收人超过上限时单独成组
+        :param items: [(消息标识, {"touser": set, "toparty": set, "totag": set}), ...]
+        :returns [([(消息标识, 接收人), ...], 合并的接收人), ...]
+        """
+        chunks = []
+        chunk_items = []
+        chunk_recipients = {key: set() for key, __ in RECIPIENT_LIMITS}
+        for message_key, recipients in items:
+            merged = {
+                key: chunk_recipients[key] | recipients[key]
+                for key, __ in RECIPIENT_LIMITS
+            }
+            if chunk_items and any(
+                len(merged[key]) > limit for key, limit in RECIPIENT_LIMITS
+            ):
+                chunks.append((chunk_items, chunk_recipients))
+                chunk_items = []
+                merged = {key: set(recipients[key]) for key, __ in RECIPIENT_LIMITS}
+            chunk_items.append((message_key, recipients))
+            chunk_recipients = merged
+        if chunk_items:
+            chunks.append((chunk_items, chunk_recipients))
+        return chunks
+
+    def send_merged_messages(self, wxapi, messages):
+        """
+        合并发送企业微信消息
+        内容、类型和选项相同的消息合并接收人后并发发送，结果再拆分回每条消息
+        合并发送的消息共用同一个企业微信消息ID，不能单独撤回；发送给 @all 的消息不合并
+        :param wxapi: 企业微信消息API
+        :param messages: [(消息标识, build_message 生成且已删除 company 的消息), ...]
+        :returns {消息标识: ApiException 或 {"msgid": 消息ID, "invalid": 无效的接收人列表, "sent": 是否有接收人收到}}
+        """
+        api_call = self.env["wecom.service_api_list"].get_server_api_call(
+            "MESSAGE_SEND"
+        )
+        groups = defaultdict(list)
+        for message_key, msg in messages:
+            msg = dict(msg)
+            recipients = {
+                key: self.split_recipients(msg.pop(key, None))
+                for key, __ in RECIPIENT_LIMITS
+            }
+            # 没有接收人的消息不与其他消息合并，仍由接口返回错误
+            has_recipients = any(recipients.values())
+            # @all 必须单独发送，不与其他消息合并
+            alone_key = message_key if "@all" in recipients["touser"] else None
+            groups[
+                (json.dumps(msg, sort_keys=True), has_recipients, alone_key)
+            ].append((message_key, recipients))
+
+        calls = []
+        chunks = []
+        for (msg_key, __, __), items in groups.items():
+            for chunk_items, chunk_recipients in self.merge_recipients(items):
+                msg = json.loads(msg_key)
+                msg.update(
+                    {
+                        key: "|".join(sorted(chunk_recipients[key]))
+                        for key, __ in RECIPIENT_LIMITS
+                    }
+                )
+                calls.append((api_call, msg))
+                chunks.append(chunk_items)
+
+        # 并发发送，结果顺序与调用顺序一致
+        results = {}
+        for chunk_items, res in zip(chunks, wxapi.httpCallBatch(calls)):
+            if isinstance(res, ApiException):
+                for message_key, __ in chunk_items:
+                    results[message_key] = res
+                continue
+            invalid_recipients = {
+                key: self.split_recipients(res.get("invalid%s" % key[2:]))
+                for key, __ in RECIPIENT_LIMITS
+            }
+            for message_key, recipients in chunk_items:
+                invalid = []
+                valid_count = 0
+                for key, __ in RECIPIENT_LIMITS:
+                    message_invalid = recipients[key] & invalid_recipients[key]
+                    invalid.extend(sorted(message_invalid))
+                    valid_count += len(recipients[key] - message_invalid)
+                results[message_key] = {
+                    "msgid": res["msgid"],
+                    "invalid": invalid,
+                    "sent": bool(valid_count or not invalid),
+                }
+        return results
+
+    def get_send_result_values(self, result):
+        """
+        将 send_merged_messages 的发送结果转换为消息的写入值
+        接收人全部无效的消息标记为异常，部分无效的消息记录无效的接收人
+        :param result: ApiException、构建消息时的 UserError 或发送结果
+        :returns {"state": "sent" 或 "exception", "msgid": 消息ID, "failure_reason": 失败原因}
+        """
+        if isinstance(result, UserError):
+            return {
+                "state": "exception",
+                "msgid": False,
+                "failure_reason": str(result),
+            }
+        if isinstance(result, ApiException):
+            error = self.env["wecom.service_api_error"].get_error_by_code(
+                result.errCode
+            )
+            return {
+                "state": "exception",
+                "msgid": False,
+                "failure_reason": "%s %s" % (str(error["code"]), error["name"]),
+            }
+        return {
+            "state": "sent" if result["sent"] else "exception",
+            "msgid": result["msgid"],
+            "failure_reason": _("Invalid recipients: %s") % "|".join(result["invalid"])
+            if result["invalid"]
+            else False,
+        }
+
     @api.model
     def send_message(self, message):
 
@@ -3,10 +3,16 @@
 import logging
 from collections import defaultdict
 from odoo import api, fields, models, tools, _
+from odoo.exceptions import UserError
 from odoo.addons.wecom_api.api.wecom_abstract_api import ApiException
 
 _logger = logging.getLogger(__name__)
 
+# 每批发送的消息数
+MESSAGE_BATCH_SIZE = 1000
+# 自动提交时每批提交的消息数
+MESSAGE_COMMIT_BATCH_SIZE = 100
+
 
 class WecomMessageMessage(models.Model):
     """
@@ -313,11 +319,8 @@ class WecomMessageMessage(models.Model):
         """
         拆分消息
         """
-        groups = defaultdict(list)
-
-        for record_ids in groups.items():
-            for message_batch in tools.split_every(record_ids):
-                yield message_batch
+        for message_batch in tools.split_every(MESSAGE_BATCH_SIZE, self.ids):
+            yield message_batch
 
     def send(
         self, auto_commit=False, raise_exception=False, company=None,
@@ -336,7 +339,7 @@ class WecomMessageMessage(models.Model):
         if not company:
             company = self.env.company
 
-        for batch_ids in self.ids:
+        for batch_ids in self._split_messages():
             try:
                 WeComMessageApi = self.env["wecom.message.api"].get_message_api(company)
             except ApiException as exc:
@@ -366,62 +369,64 @@ class WecomMessageMessage(models.Model):
     ):
         """
         发送企业微信消息
-        :param bool auto_commit: 发送每封邮件后是否强制提交邮件状态（仅用于调度程序处理）；
+        :param bool auto_commit: 每批 MESSAGE_COMMIT_BATCH_SIZE 条消息发送后是否强制提交消息状态（仅用于调度程序处理）；
                  在正常发送绝对不能为True（默认值：False）
-        :param bool raise_exception: 如果电子邮件发送过程失败，是否引发异常
+        :param bool raise_exception: 如果电子邮件发送过程失败，是否引发异常；构建消息时的 UserError 直接抛出
         :return: True
         """
         if not company:
             company = self.env.company
         ApiObj = self.env["wecom.message.api"]
-        for wecom_message_id in self.ids:
-            message = None
-            try:
-                message = self.browse(wecom_message_id)
-                msg = ApiObj.build_message(
-                    msgtype=message.msgtype,
-                    touser=message.message_to_user,
-                    toparty=message.message_to_party,
-                    totag=message.message_to_tag,
-                    subject=message.subject,
-                    media_id=message.media_id,
-                    description=message.description,
-                    author_id=message.author_id,
-                    body_html=message.body_html,
-                    body_json=message.body_json,
-                    body_markdown=message.body_markdown,
-                    safe=message.safe,
-                    enable_id_trans=message.enable_id_trans,
-                    enable_duplicate_check=message.enable_duplicate_check,
-                    duplicate_check_interval=message.duplicate_check_interval,
-                    company=company,
-                )
-                del msg["company"]  # 删除message中的 company
-                res = WeComMessageApi.httpCall(
-                    self.env["wecom.service_api_list"].get_server_api_call(
-                        "MESSAGE_SEND"
-                    ),
-                    msg,
-                )
-            except ApiException as exc:
-                error = self.env["wecom.service_api_error"].get_error_by_code(
-                    exc.errCode
-                )
-                self.write(
-                    {
-                        "state": "exception",
-                        "failure_reason": "%s %s" % (str(error["code"]), error["name"]),
-                    }
-                )
-                if raise_exception:
-                    return self.env["wecomapi.tools.action"].ApiExceptionDialog(
-                        exc, raise_exception
+        first_exc = None
+        # 每批发送后提交，中断时已被接受的消息不会重复发送
+        for messages in tools.split_every(
+            MESSAGE_COMMIT_BATCH_SIZE, self.ids, self.browse
+        ):
+            msgs = []
+            results = {}
+            for message in messages:
+                try:
+                    msg = ApiObj.build_message(
+                        msgtype=message.msgtype,
+                        touser=message.message_to_user,
+                        toparty=message.message_to_party,
+                        totag=message.message_to_tag,
+                        subject=message.subject,
+                        media_id=message.media_id,
+                        description=message.description,
+                        author_id=message.author_id,
+                        body_html=message.body_html,
+                        body_json=message.body_json,
+                        body_markdown=message.body_markdown,
+                        safe=message.safe,
+                        enable_id_trans=message.enable_id_trans,
+                        enable_duplicate_check=message.enable_duplicate_check,
+                        duplicate_check_interval=message.duplicate_check_interval,
+                        company=company,
                     )
-            else:
-                # 如果try中的程序执行过程中没有发生错误，继续执行else中的程序；
-                message.write(
-                    {"state": "sent", "msgid": res["msgid"],}
-                )
+                except (ApiException, UserError) as exc:
+                    if raise_exception and isinstance(exc, UserError):
+                        raise
+                    # 构建失败的消息单独记录异常，不影响其他消息
+                    results[message.id] = exc
+                    continue
+                del msg["company"]  # 删除message中的 company
+                msgs.append((message.id, msg))
+
+            # 内容、类型和选项相同的消息合并接收人后一起发送
+            results.update(ApiObj.send_merged_messages(WeComMessageApi, msgs))
+            vals_groups = defaultdict(list)
+            for message_id, result in results.items():
+                if isinstance(result, ApiException):
+                    first_exc = first_exc or result
+                vals = ApiObj.get_send_result_values(result)
+                vals_groups[tuple(sorted(vals.items()))].append(message_id)
+            for vals, message_ids in vals_groups.items():
+                self.browse(message_ids).write(dict(vals))
             if auto_commit is True:
                 self._cr.commit()
+        if first_exc and raise_exception:
+            return self.env["wecomapi.tools.action"].ApiExceptionDialog(
+                first_exc, raise_exception
+            )
         return True
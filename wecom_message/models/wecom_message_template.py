@@ -214,15 +214,15 @@ class WeComMessageTemplate(models.Model):
             for field in fields:
                 template = template.with_context(safe=(field == "subject"))
                 if template.msgtype == "mpnews":
-                    generated_field_values = template._render_field(
+                    generated_field_values = template._render_wecom_field(
                         field, template_res_ids, post_process=(field == "body_html")
                     )
                 elif template.msgtype == "markdown":
-                    generated_field_values = template._render_field(
+                    generated_field_values = template._render_wecom_field(
                         field, template_res_ids, post_process=(field == "body_markdown")
                     )
                 else:
-                    generated_field_values = template._render_field(
+                    generated_field_values = template._render_wecom_field(
                         field,
                         template_res_ids,
                         post_process=(field == "body_json"),
@@ -242,11 +242,14 @@ class WeComMessageTemplate(models.Model):
             # ):
             #     results = template.generate_recipients(results, template_res_ids)
 
-            # 更新所有res_id的值
+            # 更新所有res_id的值，相同的内容只处理一次
+            self._postprocess_wecom_values(
+                [results[res_id] for res_id in template_res_ids],
+                "body_html",
+                tools.html_sanitize,
+            )
             for res_id in template_res_ids:
                 values = results[res_id]
-                if values.get("body_html"):
-                    values["body_html"] = tools.html_sanitize(values["body_html"])
                 # if values.get("body_json"):
                 #     # 删除html标记内的编码属性
                 #     values["body_json"] = tools.html_sanitize(values["body_json"])
@@ -2,11 +2,14 @@
 
 import ast
 import base64
+import logging
 import re
 
 from odoo import _, api, fields, models, tools
 from odoo.exceptions import UserError
 
+_logger = logging.getLogger(__name__)
+
 
 def _reopen(self, res_id, model, context=None):
     # 在上下文中保存原始模型，因为选择可用模板列表需要上下文中的模型
@@ -102,6 +105,12 @@ class MailComposer(models.TransientModel):
         help="Indicates whether the message check is repeated. The default is 1800s and the maximum is no more than 4 hours",
         default="1800",
     )
+    wecom_posted_count = fields.Integer(
+        string="WeCom messages posted",
+        default=0,
+        readonly=True,
+        help="Number of records already posted in mass post mode, used to resume an interrupted sending",
+    )
 
     # ------------------------------------------------------------
     # 动作
@@ -170,6 +179,18 @@ class MailComposer(models.TransientModel):
             else:
                 res_ids = [wizard.res_id]
 
+            # 企业微信消息批量发布：每批一次创建消息，企业微信消息入队后统一发送
+            wecom_bulk_mode = (
+                wizard.is_wecom_message
+                and wizard.composition_mode == "mass_post"
+                and ActiveModel._name != "mail.thread"
+                and not wizard.attachment_ids
+            )
+            if wecom_bulk_mode:
+                # 从上次中断的位置继续
+                total_count = len(res_ids)
+                res_ids = res_ids[wizard.wecom_posted_count :]
+
             batch_size = (
                 int(self.env["ir.config_parameter"].sudo().get_param("mail.batch_size"))
                 or self._batch_size
@@ -198,6 +219,24 @@ class MailComposer(models.TransientModel):
                 all_mail_values = wizard.get_mail_values(
                     res_ids
                 )  # 生成send_mail用来创建mail_messages或mail_mails的值。
+                if wecom_bulk_mode:
+                    wizard._post_wecom_messages_batch(
+                        ActiveModel,
+                        all_mail_values,
+                        subtype_id=subtype_id,
+                        notif_layout=notif_layout,
+                        model_description=model_description,
+                    )
+                    wizard.wecom_posted_count += len(res_ids)
+                    _logger.info(
+                        "WeCom mass post on %s: %s/%s records posted",
+                        wizard.model,
+                        wizard.wecom_posted_count,
+                        total_count,
+                    )
+                    if auto_commit is True:
+                        self._cr.commit()
+                    continue
                 for res_id, mail_values in all_mail_values.items():
                     if wizard.composition_mode == "mass_mail":
                         batch_mails_sudo |= (
@@ -229,9 +268,80 @@ class MailComposer(models.TransientModel):
 
                 if wizard.composition_mode == "mass_mail":
                     # 群发模式
-                    batch_mails_sudo.send(
-                        auto_commit=auto_commit, is_wecom_message=is_wecom_message
-                    )
+                    if wizard.is_wecom_message:
+                        batch_mails_sudo.send_wecom_outbox(auto_commit=auto_commit)
+                    else:
+                        batch_mails_sudo.send(auto_commit=auto_commit)
+
+            if wecom_bulk_mode:
+                cron = self.env.ref(
+                    "wecom_message.ir_cron_send_wecom_message_queue",
+                    raise_if_not_found=False,
+                )
+                if cron:
+                    cron.sudo()._trigger()
+
+    def _post_wecom_messages_batch(
+        self, ActiveModel, all_mail_values, subtype_id, notif_layout, model_description
+    ):
+        """
+        批量发布企业微信消息
+        一次创建本批记录的消息，再逐条记录通知；企业微信通知只放入队列，由调用方统一触发发送
+        :param ActiveModel: 消息所属的模型
+        :param all_mail_values: get_mail_values 生成的值 {记录ID: 值}
+        :param subtype_id: 消息子类型ID
+        :param notif_layout: 通知布局
+        :param model_description: 模型描述
+        :returns 创建的消息
+        """
+        self.ensure_one()
+        records = ActiveModel.with_context(wecom_message_defer_trigger=True).browse(
+            list(all_mail_values)
+        )
+        if not records:
+            return self.env["mail.message"]
+        author_id, email_from = records._message_compute_author(
+            self.author_id.id, self.email_from, raise_exception=True
+        )
+        if not subtype_id:
+            subtype_id = self.env["ir.model.data"]._xmlid_to_res_id("mail.mt_note")
+        message_fields = self.env["mail.message"]._fields
+
+        values_list = []
+        for record in records:
+            mail_values = all_mail_values[record.id]
+            values = {
+                key: value
+                for key, value in mail_values.items()
+                if key in message_fields
+            }
+            values.update(
+                {
+                    "author_id": author_id,
+                    "email_from": email_from,
+                    "model": records._name,
+                    "res_id": record.id,
+                    "subject": mail_values.get("subject") or False,
+                    "message_type": self.message_type,
+                    "subtype_id": subtype_id,
+                    "add_sign": not bool(self.template_id),
+                    "is_wecom_message": True,
+                }
+            )
+            values_list.append(values)
+        messages = records._message_create(values_list)
+
+        notif_kwargs = {
+            "email_layout_xmlid": notif_layout,
+            "mail_auto_delete": self.template_id.auto_delete
+            if self.template_id
+            else False,
+            "model_description": model_description,
+        }
+        for record, message, values in zip(records, messages, values_list):
+            record._message_post_after_hook(message, values)
+            record._notify_thread(message, values, **notif_kwargs)
+        return messages
 
     def get_mail_values(self, res_ids):
         """
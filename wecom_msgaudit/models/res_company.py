@@ -17,3 +17,6 @@ class Company(models.Model):
         # default=lambda self: self.env.company,
         domain="[('company_id', '=', current_company_id)]",
     )
+    msgaudit_chatdata_seq = fields.Integer(
+        string="Chat data checkpoint seq", default=0, copy=False,
+    )
@@ -2,6 +2,7 @@
 
 import logging
 import time
+from datetime import timedelta
 import io
 import requests
 import json
@@ -16,6 +17,7 @@ from lxml import etree
 
 
 from odoo.addons.wecom_api.api.wecom_abstract_api import ApiException
+from odoo.addons.wecom_api.api.wecom_http_pool import get_session
 import pandas as pd
 
 pd.set_option("max_colwidth", 4096)  # 设置最大列宽
@@ -24,6 +26,19 @@ pd.set_option("expand_frame_repr", False)  # 当列太多时不换行
 
 _logger = logging.getLogger(__name__)
 
+# 内部群信息的刷新间隔（小时）
+GROUPCHAT_INFO_TTL = 24
+
+# 格式化消息的批量大小和获取媒体文件的线程数
+FORMAT_BATCH_SIZE = 100
+FORMAT_MAX_WORKERS = 4
+
+# 单次运行拉取聊天记录的时间（秒）和数量上限
+CHATDATA_MAX_SECONDS = 300
+CHATDATA_MAX_MESSAGES = 200000
+# 拉取一页聊天记录的请求超时（秒）
+CHATDATA_REQUEST_TIMEOUT = 60
+
 FORMATTED_MESSAGE_TYPE = [
     "text",
     "image",
@@ -234,7 +249,6 @@ class WeComMsgauditChatData(models.Model):
         获取聊天记录
         注:获取会话记录内容不能超过3天，如果企业需要全量数据，则企业需要定期拉取聊天消息。返回的ChatDatas内容为json格式。
         """
-        get_param = self.env["ir.config_parameter"].sudo().get_param
         company = self.company_id
         if not company:
             company = self.env.company
@@ -270,115 +284,319 @@ class WeComMsgauditChatData(models.Model):
             }
             key_list.append(key_dic)
 
-        # 首次访问填写0，非首次使用上次企业微信返回的最大seq。允许从任意seq重入拉取。
-        max_seq_id = 0
-        self.env.cr.execute(
-            """
-            SELECT MAX(seq)
-            FROM wecom_chat_data
-            WHERE company_id=%s
-            """
-            % (company.id)
-        )  # 查询最大seq的记录
-        results = self.env.cr.dictfetchall()
-        if results[0]["max"] is not None:
-            max_seq_id = results[0]["max"]
-
         try:
-            msgaudit_sdk_url = get_param("wecom.msgaudit.msgaudit_sdk_url")
-            msgaudit_chatdata_url = get_param("wecom.msgaudit.msgaudit_chatdata_url")
+            # 手动下载在一个事务中执行，只拉取一页，避免超过请求的时间限制后全部回滚
+            counts = self.pull_chatdatas(
+                company, secret, key_list, commit=False, max_pages=1
+            )
+            return True if counts["count"] > 0 else False
+        except ApiException as e:
+            return self.env["wecomapi.tools.action"].ApiExceptionDialog(
+                e, raise_exception=True
+            )
+        except Exception as e:
+            _logger.exception("Exception: %s" % e)
+            return str(e)
 
-            chatdata_url = msgaudit_sdk_url + msgaudit_chatdata_url
+    def pull_chatdatas(self, company, secret, key_list, commit=True, max_pages=None):
+        """
+        分页拉取聊天记录，直到没有新记录或达到单次运行的时间、数量上限
+        从企业的 seq 检查点开始拉取，每页保存后更新检查点，commit 为 True 时每页提交一次，中断后可从检查点继续
+        请求超时时结束本次拉取，保留已保存的检查点
+        :param secret: 会话内容存档应用的凭证密钥
+        :param key_list: 消息加密私钥列表
+        :param commit: 是否每页提交事务
+        :param max_pages: 最多拉取的页数，为空时只受时间和数量上限限制
+        :returns {"count": 下载的记录数, "pages": 页数, "seq": 检查点}
+        """
+        get_param = self.env["ir.config_parameter"].sudo().get_param
+        max_seconds = int(
+            get_param("wecom.msgaudit.chatdata_max_seconds", CHATDATA_MAX_SECONDS)
+        )
+        max_messages = int(
+            get_param("wecom.msgaudit.chatdata_max_messages", CHATDATA_MAX_MESSAGES)
+        )
+        timeout = float(
+            get_param("wecom.msgaudit.chatdata_timeout", CHATDATA_REQUEST_TIMEOUT)
+        )
 
-            proxy = True if get_param("wecom.msgaudit_sdk_proxy") == "True" else False
-            headers = {"content-type": "application/json"}
+        msgaudit_sdk_url = get_param("wecom.msgaudit.msgaudit_sdk_url")
+        msgaudit_chatdata_url = get_param("wecom.msgaudit.msgaudit_chatdata_url")
+        chatdata_url = msgaudit_sdk_url + msgaudit_chatdata_url
+        proxy = True if get_param("wecom.msgaudit_sdk_proxy") == "True" else False
+        headers = {"content-type": "application/json"}
+        session = get_session(chatdata_url)
+
+        seq = self.get_chatdata_checkpoint(company)
+        counts = {"count": 0, "pages": 0, "seq": seq}
+        start_time = time.monotonic()
+        while True:
+            # 首次访问填写0，非首次使用上次企业微信返回的最大seq。允许从任意seq重入拉取。
             body = {
-                "seq": max_seq_id,
-                "corpid": corpid,
+                "seq": seq,
+                "corpid": company.corpid,
                 "secret": secret,
                 "private_keys": key_list,
             }
-
             if proxy:
                 body.update(
                     {"proxy": msgaudit_chatdata_url, "paswd": "odoo:odoo",}
                 )
+            try:
+                response = session.get(
+                    chatdata_url,
+                    data=json.dumps(body),
+                    headers=headers,
+                    timeout=timeout,
+                ).json()
+            except requests.Timeout:
+                _logger.warning(
+                    _(
+                        "Timed out pulling chat data of company [%s] at seq %s, will resume from the checkpoint next time"
+                    )
+                    % (company.name, seq)
+                )
+                break
+            if response["code"] != 0:
+                raise UserError(
+                    _(
+                        "Request error, error code:%s, error description:%s, suggestion:%s"
+                    )
+                    % (
+                        response["code"],
+                        response["description"],
+                        response["suggestion"],
+                    )
+                )
 
-            response = requests.get(
-                chatdata_url, data=json.dumps(body), headers=headers
-            ).json()
-
-            if response["code"] == 0:
-                chat_datas = response["data"]
-                if len(chat_datas) > 0:
-                    for data in chat_datas:
-                        dic_data = {}
-
-                        is_external_msg = True if "external" in data["msgid"] else False
-                        dic_data = {
-                            "seq": data["seq"],
-                            "msgid": data["msgid"],
-                            "publickey_ver": data["publickey_ver"],
-                            "encrypt_random_key": data["encrypt_random_key"],
-                            "encrypt_chat_msg": data["encrypt_chat_msg"],
-                            "decrypted_chat_msg": json.dumps(
-                                data["decrypted_chat_msg"]
-                            ),
-                            "is_external_msg": is_external_msg,
-                        }
-                        # auto_get_internal_groupchat_name = ir_config.get_param(
-                        #     "wecom.msgaudit.auto_get_internal_groupchat_name"
-                        # )
-                        # 以下为解密聊天信息内容
-                        for key, value in data["decrypted_chat_msg"].items():
-                            if key == "msgid":
-                                pass
-                            elif key == "voiceid":
-                                pass
-                            elif key == "from":
-                                dic_data["from_user"] = value
-                                # 创建发送者
-                                sender = self.get_and_create_chat_sender(value)
-                                dic_data.update({"sender": sender.id})
-                            elif key == "tolist":
-                                dic_data["tolist"] = json.dumps(value)
-                            elif key == "roomid" and value:
-                                room = {}
-                                if is_external_msg:
-                                    # 外部消息
-                                    room = {
-                                        "roomid": value,
-                                    }
-                                else:
-                                    # 内部群可以通过API获取群信息
-                                    room = self.get_group_chat_info_by_roomid(
-                                        company, value
-                                    )
-                                group_chat = self.create_group_chat(room)
-                                dic_data.update({"room": group_chat.id})
-                            elif key == "msgtime" or key == "time":
-                                time_stamp = value
-                                # dic_data[key] = self.timestamp2datetime(time_stamp)
-                                dic_data.update(
-                                    {key: self.timestamp2datetime(time_stamp)}
-                                )
-                            else:
-                                dic_data.update({key: value})
-                        self.sudo().create(dic_data)
-                    return True
+            chat_datas = response["data"]
+            if not chat_datas:
+                break
+            self.create_chat_datas(company, chat_datas)
+            next_seq = max(data["seq"] for data in chat_datas)
+            company.sudo().write({"msgaudit_chatdata_seq": next_seq})
+            if commit:
+                self.env.cr.commit()
+
+            counts["count"] += len(chat_datas)
+            counts["pages"] += 1
+            counts["seq"] = next_seq
+            if next_seq <= seq:
+                # seq 没有前进，避免重复拉取同一页
+                break
+            seq = next_seq
+            if counts["count"] >= max_messages:
+                break
+            if max_pages and counts["pages"] >= max_pages:
+                break
+            if time.monotonic() - start_time >= max_seconds:
+                break
+        return counts
+
+    def get_chatdata_checkpoint(self, company):
+        """
+        获取企业的 seq 检查点
+        检查点不存在时（升级前已下载过聊天记录），从已下载记录的最大seq初始化
+        """
+        if company.msgaudit_chatdata_seq:
+            return company.msgaudit_chatdata_seq
+        self.env.cr.execute(
+            """
+            SELECT MAX(seq)
+            FROM wecom_chat_data
+            WHERE company_id=%s
+            """,
+            (company.id,),
+        )  # 查询最大seq的记录
+        max_seq_id = self.env.cr.fetchone()[0]
+        return max_seq_id or 0
+
+    def create_chat_datas(self, company, chat_datas):
+        """
+        批量保存一页聊天记录
+        一次遍历生成记录的值，发送者和群聊从预加载的字典获取，缺少的发送者和群聊批量创建，聊天记录一次批量创建
+        :param chat_datas: SDK 返回的聊天记录列表
+        :returns 创建的聊天记录
+        """
+        if not chat_datas:
+            return self.browse()
+
+        roomids = []
+        for data in chat_datas:
+            roomid = data["decrypted_chat_msg"].get("roomid")
+            if roomid and roomid not in roomids:
+                roomids.append(roomid)
+        group_chats = self.get_group_chats(
+            company, roomids, self._get_internal_roomids(chat_datas)
+        )
+        senders = self.get_chat_senders(
+            company, [data["decrypted_chat_msg"].get("from") for data in chat_datas]
+        )
+
+        vals_list = []
+        for data in chat_datas:
+            is_external_msg = True if "external" in data["msgid"] else False
+            dic_data = {
+                "company_id": company.id,
+                "seq": data["seq"],
+                "msgid": data["msgid"],
+                "publickey_ver": data["publickey_ver"],
+                "encrypt_random_key": data["encrypt_random_key"],
+                "encrypt_chat_msg": data["encrypt_chat_msg"],
+                "decrypted_chat_msg": json.dumps(data["decrypted_chat_msg"]),
+                "is_external_msg": is_external_msg,
+            }
+            # 以下为解密聊天信息内容
+            for key, value in data["decrypted_chat_msg"].items():
+                if key == "msgid":
+                    pass
+                elif key == "voiceid":
+                    pass
+                elif key == "from":
+                    dic_data["from_user"] = value
+                    if value in senders:
+                        dic_data.update({"sender": senders[value].id})
+                elif key == "tolist":
+                    dic_data["tolist"] = json.dumps(value)
+                elif key == "roomid" and value:
+                    dic_data.update({"room": group_chats[value].id})
+                elif key == "msgtime" or key == "time":
+                    dic_data.update({key: self.timestamp2datetime(value)})
                 else:
-                    return False
+                    dic_data.update({key: value})
+            vals_list.append(dic_data)
+        return self.sudo().create(vals_list)
+
+    def get_chat_senders(self, company, sender_ids):
+        """
+        批量获取发送者，不存在的发送者批量创建
+        :param sender_ids: 发送者ID列表
+        :returns {发送者ID: 发送者}
+        """
+        ChatSender = self.env["wecom.chat.sender"].sudo()
+        sender_ids = list({sender_id for sender_id in sender_ids if sender_id})
+        senders = {}
+        if not sender_ids:
+            return senders
+        for sender in ChatSender.search(
+            [("sender_id", "in", sender_ids)], order="id desc"
+        ):
+            senders[sender.sender_id] = sender
+
+        missing_sender_ids = [
+            sender_id for sender_id in sender_ids if sender_id not in senders
+        ]
+        staff_ids = [
+            sender_id
+            for sender_id in missing_sender_ids
+            if "wo-" not in sender_id and "wm-" not in sender_id
+        ]
+        partners = {}
+        employees = {}
+        if staff_ids:
+            for partner in self.env["res.partner"].search(
+                [("wecom_userid", "in", staff_ids)]
+            ):
+                partners.setdefault(partner.wecom_userid, partner)
+            for employee in self.env["hr.employee"].search(
+                [("wecom_userid", "in", staff_ids), ("company_id", "=", company.id)]
+            ):
+                employees.setdefault(employee.wecom_userid, employee)
+
+        if missing_sender_ids:
+            created_senders = ChatSender.create(
+                [
+                    self._prepare_chat_sender_values(
+                        sender_id, partners.get(sender_id), employees.get(sender_id)
+                    )
+                    for sender_id in missing_sender_ids
+                ]
+            )
+            senders.update(zip(missing_sender_ids, created_senders))
+        return senders
+
+    def _prepare_chat_sender_values(self, sender_id, partner=None, employee=None):
+        """
+        生成发送者的值
+        :param partner: 企微用户ID与发送者ID相同的联系人
+        :param employee: 企微用户ID与发送者ID相同的员工
+        """
+        dic = {}
+        dic.update({"sender_id": sender_id})
+        if "wo-" in sender_id or "wm-" in sender_id:
+            dic.update({"name": sender_id[-6:]})
+            if "wo-" in sender_id:
+                dic.update({"sender_type": "wecom"})
+            if "wm-" in sender_id:
+                dic.update({"sender_type": "wechat"})
+        else:
+            dic.update({"sender_type": "staff"})
+            if employee:
+                dic.update({"employee_id": employee.id})
+            # 优先使用 联系人的名称
+            if partner:
+                dic.update(
+                    {"partner_id": partner.id, "name": partner.name,}
+                )
             else:
-                return _(
-                    "Request error, error code:%s, error description:%s, suggestion:%s"
-                ) % (response["code"], response["description"], response["suggestion"])
-        except ApiException as e:
-            return self.env["wecomapi.tools.action"].ApiExceptionDialog(
-                e, raise_exception=True
+                if employee:
+                    dic.update({"name": employee.name})
+                else:
+                    dic.update(
+                        {"name": sender_id[-6:] if len(sender_id) > 6 else sender_id}
+                    )
+        return dic
+
+    def get_group_chats(self, company, roomids, internal_roomids=None):
+        """
+        批量获取群聊，不存在的群聊批量创建
+        内部群的群信息以群聊记录作为缓存，只有新群或群信息超过刷新间隔的群才通过API并发获取
+        :param roomids: 群ID列表
+        :param internal_roomids: 其中内部群的群ID列表
+        :returns {群ID: 群聊}
+        """
+        ChatGroup = self.env["wecom.chat.group"].sudo()
+        group_chats = {}
+        if not roomids:
+            return group_chats
+        for group_chat in ChatGroup.search(
+            [("roomid", "in", roomids)], order="id desc"
+        ):
+            group_chats[group_chat.roomid] = group_chat
+
+        ttl = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("wecom.msgaudit.groupchat_info_ttl", GROUPCHAT_INFO_TTL)
+        )
+        expired_time = fields.Datetime.now() - timedelta(hours=ttl)
+        expired_roomids = [
+            roomid
+            for roomid in internal_roomids or []
+            if roomid not in group_chats
+            or not group_chats[roomid].room_refresh_time
+            or group_chats[roomid].room_refresh_time < expired_time
+        ]
+        # 获取失败的群不在字典中，下一批次重新获取
+        room_infos = self.get_group_chat_infos_by_roomids(company, expired_roomids)
+        for roomid, room_info in room_infos.items():
+            room_info["room_refresh_time"] = fields.Datetime.now()
+            if roomid in group_chats:
+                group_chats[roomid].write(room_info)
+
+        missing_roomids = [roomid for roomid in roomids if roomid not in group_chats]
+        if missing_roomids:
+            created_group_chats = ChatGroup.create(
+                [
+                    dict(
+                        room_infos.get(roomid) or {"roomid": roomid},
+                        company_id=company.id,
+                    )
+                    for roomid in missing_roomids
+                ]
             )
-        except Exception as e:
-            _logger.exception("Exception: %s" % e)
-            return str(e)
+            group_chats.update(zip(missing_roomids, created_group_chats))
+        return group_chats
 
     def bind_internal_group_chat(self):
         """
@@ -438,6 +656,62 @@ class WeComMsgauditChatData(models.Model):
         finally:
             return room_dic
 
+    def _get_internal_roomids(self, chat_datas):
+        """
+        获取聊天记录中去重后的内部群ID
+        """
+        roomids = []
+        for data in chat_datas:
+            roomid = data["decrypted_chat_msg"].get("roomid")
+            if roomid and "external" not in data["msgid"] and roomid not in roomids:
+                roomids.append(roomid)
+        return roomids
+
+    def get_group_chat_infos_by_roomids(self, company_id, roomids):
+        """
+        并发获取多个内部群聊信息
+        :returns 群ID与群信息的字典，获取失败的群不在字典中
+        """
+        company = company_id
+        if not company:
+            company = self.env.company
+        rooms = {}
+        if not roomids:
+            return rooms
+        try:
+            wxapi = self.env["wecom.service_api"].InitServiceApi(
+                company.corpid, company.msgaudit_app_id.secret
+            )
+        except ApiException as ex:
+            _logger.warning(
+                _("Failed to get internal group chat information, reason:%s") % ex
+            )
+            return rooms
+        api_call = self.env["wecom.service_api_list"].get_server_api_call(
+            "MSGAUDIT_GROUPCHAT_GET"
+        )
+        responses = wxapi.httpCallBatch(
+            [(api_call, {"roomid": roomid}) for roomid in roomids]
+        )
+        for roomid, response in zip(roomids, responses):
+            if isinstance(response, ApiException):
+                _logger.warning(
+                    _("Failed to get internal group chat [%s] information, reason:%s")
+                    % (roomid, response)
+                )
+                continue
+            rooms[roomid] = {
+                "roomid": roomid,
+                "room_name": response["roomname"],
+                "room_creator": response["creator"],
+                "room_notice": response["notice"],
+                "room_create_time": self.timestamp2datetime(
+                    response["room_create_time"]
+                ),
+                "room_members": json.dumps(response["members"]),
+            }
+        return rooms
+
     def create_group_chat(self, room):
         """
         创建群聊
@@ -454,7 +728,7 @@ class WeComMsgauditChatData(models.Model):
             if not company:
                 company = self.env.company
             room.update({"company_id": company.id})
-            groupchat.create(room)
+            groupchat = groupchat.create(room)
         return groupchat
 
     def update_group_chat(self):
@@ -513,16 +787,8 @@ class WeComMsgauditChatData(models.Model):
         if sender:
             return sender
         else:
-            dic = {}
-            dic.update({"sender_id": sender_id})
-            if "wo-" in sender_id or "wm-" in sender_id:
-                dic.update({"name": sender_id[-6:]})
-                if "wo-" in sender_id:
-                    dic.update({"sender_type": "wecom"})
-                if "wm-" in sender_id:
-                    dic.update({"sender_type": "wechat"})
-            else:
-                dic.update({"sender_type": "staff"})
+            partner = employee = None
+            if "wo-" not in sender_id and "wm-" not in sender_id:
                 partner = self.env["res.partner"].search(
                     [("wecom_userid", "=", sender_id),], limit=1,
                 )
@@ -536,25 +802,7 @@ class WeComMsgauditChatData(models.Model):
                     ],
                     limit=1,
                 )
-
-                if employee:
-                    dic.update({"employee_id": employee.id})
-                # 优先使用 联系人的名称
-                if partner:
-                    dic.update(
-                        {"partner_id": partner.id, "name": partner.name,}
-                    )
-                else:
-                    if employee:
-                        dic.update({"name": employee.name})
-                    else:
-                        dic.update(
-                            {
-                                "name": sender_id[-6:]
-                                if len(sender_id) > 6
-                                else sender_id
-                            }
-                        )
+            dic = self._prepare_chat_sender_values(sender_id, partner, employee)
             sender = self.env["wecom.chat.sender"].sudo().create(dic)
             return sender
 
@@ -668,7 +916,6 @@ class WeComMsgauditChatData(models.Model):
                 _("Automatic task: Start download session content record for [%s]")
                 % app.company_id.name
             )
-            corpid = app.company_id.corpid
             secret = app.secret
             private_keys = app.private_keys
             key_list = []
@@ -679,132 +926,30 @@ class WeComMsgauditChatData(models.Model):
                     "private_key": key.private_key,
                 }
                 key_list.append(key_dic)
-            # 首次访问填写0，非首次使用上次企业微信返回的最大seq。允许从任意seq重入拉取。
-            max_seq_id = 0
-            self.env.cr.execute(
-                """
-                SELECT MAX(seq)
-                FROM wecom_chat_data
-                WHERE company_id=%s
-                """
-                % (app.company_id.id)
-            )  # 查询最大seq的记录
-            results = self.env.cr.dictfetchall()
-            if results[0]["max"] is not None:
-                max_seq_id = results[0]["max"]
-
             try:
-                get_param = self.env["ir.config_parameter"].sudo().get_param
-
-                msgaudit_sdk_url = get_param("wecom.msgaudit.msgaudit_sdk_url")
-                msgaudit_chatdata_url = get_param(
-                    "wecom.msgaudit.msgaudit_chatdata_url"
-                )
-
-                chatdata_url = msgaudit_sdk_url + msgaudit_chatdata_url
-
-                proxy = (
-                    True if get_param("wecom.msgaudit_sdk_proxy") == "True" else False
-                )
-                headers = {"content-type": "application/json"}
-                body = {
-                    "seq": max_seq_id,
-                    "corpid": corpid,
-                    "secret": secret,
-                    "private_keys": key_list,
-                }
-                if proxy:
-                    body.update(
-                        {"proxy": msgaudit_chatdata_url, "paswd": "odoo:odoo",}
-                    )
-
-                response = requests.get(
-                    chatdata_url, data=json.dumps(body), headers=headers
-                ).json()
-
-                if response["code"] == 0:
-                    chat_datas = response["data"]
-
-                    if len(chat_datas) > 0:
-                        for data in chat_datas:
-                            dic_data = {}
-                            is_external_msg = (
-                                True if "external" in data["msgid"] else False
-                            )
-                            dic_data = {
-                                "company_id": app.company_id.id,
-                                "seq": data["seq"],
-                                "msgid": data["msgid"],
-                                "publickey_ver": data["publickey_ver"],
-                                "encrypt_random_key": data["encrypt_random_key"],
-                                "encrypt_chat_msg": data["encrypt_chat_msg"],
-                                "decrypted_chat_msg": json.dumps(
-                                    data["decrypted_chat_msg"]
-                                ),
-                                "is_external_msg": is_external_msg,
-                            }
-
-                            # 以下为解密聊天信息内容
-                            for key, value in data["decrypted_chat_msg"].items():
-                                if key == "msgid":
-                                    pass
-                                elif key == "voiceid":
-                                    pass
-                                elif key == "from":
-                                    dic_data["from_user"] = value
-                                    # 创建发送者
-                                    sender = self.get_and_create_chat_sender(value)
-                                    dic_data.update({"sender": sender.id})
-                                elif key == "tolist":
-                                    dic_data["tolist"] = json.dumps(value)
-                                elif key == "roomid" and value:
-                                    room = {}
-                                    if is_external_msg:
-                                        room = {
-                                            "roomid": value,
-                                        }
-                                    else:
-                                        # 内部群可以通过API获取群信息
-                                        room = self.get_group_chat_info_by_roomid(
-                                            app.company_id, value
-                                        )
-                                    group_chat = self.create_group_chat(room)
-                                    dic_data.update({"room": group_chat.id})
-                                elif key == "msgtime" or key == "time":
-                                    time_stamp = value
-                                    # dic_data[key] = self.timestamp2datetime(time_stamp)
-                                    dic_data.update(
-                                        {key: self.timestamp2datetime(time_stamp)}
-                                    )
-                                else:
-                                    dic_data.update({key: value})
-
-                            self.sudo().create(dic_data)
-                        _logger.info(
-                            _(
-                                "Automatic task: End download session content record for [%s]"
-                            )
-                            % app.company_id.name
+                counts = self.pull_chatdatas(app.company_id, secret, key_list)
+                if counts["count"] > 0:
+                    _logger.info(
+                        _(
+                            "Automatic task: End download session content record for [%s], downloaded %s records in %s pages, checkpoint seq: %s"
                         )
-                    else:
-                        _logger.info(
-                            _(
-                                "Automatic task: End download session content record for [%s],There are no records to download."
-                            )
-                            % app.company_id.name
+                        % (
+                            app.company_id.name,
+                            counts["count"],
+                            counts["pages"],
+                            counts["seq"],
                         )
+                    )
                 else:
-                    _logger.warning(
+                    _logger.info(
                         _(
-                            "Request error, error code:%s, error description:%s, suggestion:%s"
-                        )
-                        % (
-                            response["code"],
-                            response["description"],
-                            response["suggestion"],
+                            "Automatic task: End download session content record for [%s],There are no records to download."
                         )
+                        % app.company_id.name
                     )
             except ApiException as e:
+                # 已提交的页保留，只回滚当前页
+                self.env.cr.rollback()
                 _logger.exception(
                     _(
                         "Automatic task: Exception in downloading session content record for [%s],Exception:%s"
@@ -812,6 +957,7 @@ class WeComMsgauditChatData(models.Model):
                     % (app.company_id.name, str(e))
                 )
             except Exception as e:
+                self.env.cr.rollback()
                 _logger.exception(
                     _(
                         "Automatic task: Exception in downloading session content record for [%s],Exception:%s"
@@ -825,14 +971,54 @@ class WeComMsgauditChatData(models.Model):
         暂时支持消息类型: text / link / image 
         超过3天未格式化的数据,pass掉
         切换企业日志类型的消息,pass掉
+        按消息时间从新到旧分批格式化，避免新消息的媒体文件超过3天无法获取
+        每批图片消息的媒体文件并发获取，每批提交一次
         """
         _logger.info(
             _("Automatic task: Start formatting session content archive record.")
         )
-        chats = self.search([("formatted", "=", False), ("action", "!=", "switch")])
+        max_workers = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("wecom.msgaudit.format_max_workers", FORMAT_MAX_WORKERS)
+        )
+        chats = self.search(
+            [("formatted", "=", False), ("action", "!=", "switch")],
+            order="msgtime desc, id desc",
+        )
 
-        for chat in chats:
-            chat.format_content()
+        for batch in tools.split_every(FORMAT_BATCH_SIZE, chats.ids, self.browse):
+            # 每条消息只检查一次是否需要格式化，检查失败的消息跳过
+            allowed_chats = self.browse()
+            for chat in batch:
+                try:
+                    if chat._allow_formatting():
+                        allowed_chats |= chat
+                except Exception as e:
+                    _logger.warning(
+                        _(
+                            "Automatic task: Failed to format session content archive record [%s], reason:%s"
+                        )
+                        % (chat.msgid, e)
+                    )
+            image_chats = allowed_chats.filtered(lambda chat: chat.msgtype == "image")
+            responses = self.env["wecom.msgaudit.tools"].fetch_image_mediadatas(
+                image_chats, max_workers
+            )
+            for chat in allowed_chats:
+                try:
+                    with self.env.cr.savepoint():
+                        chat.format_content(
+                            response=responses.get(chat.id), allow_formatting=True
+                        )
+                except Exception as e:
+                    _logger.warning(
+                        _(
+                            "Automatic task: Failed to format session content archive record [%s], reason:%s"
+                        )
+                        % (chat.msgid, e)
+                    )
+            self.env.cr.commit()
 
         _logger.info(
             _("Automatic task: End formatting session content archive record.")
@@ -841,10 +1027,12 @@ class WeComMsgauditChatData(models.Model):
     # ------------------------------------------------------------
     # 工具
     # ------------------------------------------------------------
-    def format_content(self):
+    def format_content(self, response=None, allow_formatting=None):
         """
         格式化消息内容
         暂时支持消息类型: 见 FORMATTED_MESSAGE_TYPE 定义
+        :param response: 图片消息预先获取的SDK响应
+        :param allow_formatting: 预先检查的是否需要格式化，为 None 时重新检查
         """
         formatted = False
         company = self.company_id
@@ -860,22 +1048,8 @@ class WeComMsgauditChatData(models.Model):
 
         content = self[self._fields[self.msgtype].name]
 
-        allow_formatting = False
-
-        if content[0] == "{" and self.msgtype in FORMATTED_MESSAGE_TYPE:
-            # 是json格式的内容
-            allow_formatting = True
-        elif self.msgtype == "image":
-            # 检查图片是否可以打开
-            tree = etree.HTML(self.image)
-            image_str = tree.xpath("//img/@src")[0]
-            if self.env["wecom.msgaudit.tools"].verify_img(image_str):
-                # 图片正常,不允许格式化
-                allow_formatting = False
-            else:
-                # 图片异常,允许格式化
-                allow_formatting = True
-
+        if allow_formatting is None:
+            allow_formatting = self._allow_formatting()
         if allow_formatting:
             # msg_content = self[self._fields[self.msgtype].name]
 
@@ -896,7 +1070,7 @@ class WeComMsgauditChatData(models.Model):
             elif self.msgtype == "image":
                 # 图片消息
                 format_result = self.env["wecom.msgaudit.tools"].format_image_message(
-                    self
+                    self, response=response
                 )
                 formatted = format_result["formatted"]
                 content = format_result["content"]
@@ -915,3 +1089,25 @@ class WeComMsgauditChatData(models.Model):
                 {self._fields[self.msgtype].name: content, "formatted": formatted,}
             )
 
+    def _allow_formatting(self):
+        """
+        检查消息是否需要格式化
+        """
+        content = self[self._fields[self.msgtype].name]
+
+        allow_formatting = False
+
+        if content[0] == "{" and self.msgtype in FORMATTED_MESSAGE_TYPE:
+            # 是json格式的内容
+            allow_formatting = True
+        elif self.msgtype == "image":
+            # 检查图片是否可以打开
+            tree = etree.HTML(self.image)
+            image_str = tree.xpath("//img/@src")[0]
+            if self.env["wecom.msgaudit.tools"].verify_img(image_str):
+                # 图片正常,不允许格式化
+                allow_formatting = False
+            else:
+                # 图片异常,允许格式化
+                allow_formatting = True
+        return allow_formatting
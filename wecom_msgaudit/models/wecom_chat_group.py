@@ -22,6 +22,9 @@ class WeComChatGroup(models.Model):
     room_create_time = fields.Datetime(string="Group chat create time")
     room_notice = fields.Text(string="Group chat notice")
     room_members = fields.Text(string="Group chat members")
+    room_refresh_time = fields.Datetime(
+        string="Group chat information refresh time", copy=False
+    )
 
     @api.depends('room_name', 'roomid',)
     def _compute_name(self):
@@ -13,9 +13,27 @@ import base64
 import logging
 import platform
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+from odoo.addons.wecom_api.api.wecom_http_pool import get_session
 
 _logger = logging.getLogger(__name__)
 
+# 获取媒体文件的超时时间（秒）
+MEDIA_REQUEST_TIMEOUT = 60
+
+
+def request_mediadata(url, body, headers, timeout=MEDIA_REQUEST_TIMEOUT):
+    """
+    请求 SDK 获取媒体文件，只做网络IO，不访问 Odoo 环境，可以在线程中执行
+    :returns 响应的json
+    """
+    return (
+        get_session(url)
+        .get(url, data=json.dumps(body), headers=headers, timeout=timeout)
+        .json()
+    )
+
 
 class WecomMsgauditTool(models.AbstractModel):
     _name = "wecom.msgaudit.tools"
@@ -62,9 +80,11 @@ class WecomMsgauditTool(models.AbstractModel):
         mixed_message=False,
         media_file_seq=0,
         is_mixed_message=False,
+        response=None,
     ):
         """
         格式化图片消息
+        :param response: 预先获取的SDK响应或请求异常，为空时在此请求
         """
         content = ""
         get_param = self.env["ir.config_parameter"].sudo().get_param
@@ -84,47 +104,17 @@ class WecomMsgauditTool(models.AbstractModel):
         else:
             content_dic = eval(msg_str)
 
-        corpid = company.corpid
-        secret = company.msgaudit_app_id.secret
-        private_keys = company.msgaudit_app_id.private_keys
-        key_list = []
-        for key in private_keys:
-            key_dic = {
-                "publickey_ver": key.publickey_ver,
-                "private_key": key.private_key,
-            }
-            key_list.append(key_dic)
-
         try:
-            mediadata_url = get_param("wecom.msgaudit.msgaudit_sdk_url") + get_param(
-                "wecom.msgaudit.msgaudit_mediadata_url"
-            )
-            proxy = True if get_param("wecom.msgaudit_sdk_proxy") == "True" else False
-
-            headers = {"content-type": "application/json"}
-            original_file_size = content_dic["filesize"]  # 图片原始大小
-            target_file_size = (
-                int(get_param("wecom.msgaudit.chatdata_img_max_size")) * 1024
-            )  # 图片最大大小，超过此大小，进行压缩
-
-            body = {
-                "seq": 0,
-                "sdkfileid": content_dic["sdkfileid"],
-                "corpid": corpid,
-                "secret": secret,
-                "private_keys": key_list,
-                "target_file_size": target_file_size,
-                "original_file_size": original_file_size,
-                "msgtype": "image",
-            }
-            if proxy:
-                body.update(
-                    {"proxy": mediadata_url, "paswd": "odoo:odoo",}
+            if response is None:
+                mediadata_url, body, headers = self.prepare_mediadata_request(
+                    company, content_dic
                 )
-            response = requests.get(
-                mediadata_url, data=json.dumps(body), headers=headers, timeout=None
-            )
-            res = response.json()
+                response = request_mediadata(
+                    mediadata_url, body, headers, self.get_media_timeout()
+                )
+            if isinstance(response, Exception):
+                raise response
+            res = response
 
             if res["code"] == 0:
                 mediadata = res["data"]
@@ -293,6 +283,102 @@ class WecomMsgauditTool(models.AbstractModel):
     # --------------------------------------------------
     # 其他工具
     # --------------------------------------------------
+    def get_media_timeout(self):
+        """
+        获取媒体文件的超时时间
+        """
+        return float(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("wecom.msgaudit.media_timeout", MEDIA_REQUEST_TIMEOUT)
+        )
+
+    def prepare_mediadata_request(self, company, content_dic, msgtype="image"):
+        """
+        生成获取媒体文件的请求
+        :param content_dic: 消息内容
+        :returns (请求地址, 请求体, 请求头)
+        """
+        get_param = self.env["ir.config_parameter"].sudo().get_param
+        corpid = company.corpid
+        secret = company.msgaudit_app_id.secret
+        private_keys = company.msgaudit_app_id.private_keys
+        key_list = []
+        for key in private_keys:
+            key_dic = {
+                "publickey_ver": key.publickey_ver,
+                "private_key": key.private_key,
+            }
+            key_list.append(key_dic)
+
+        mediadata_url = get_param("wecom.msgaudit.msgaudit_sdk_url") + get_param(
+            "wecom.msgaudit.msgaudit_mediadata_url"
+        )
+        proxy = True if get_param("wecom.msgaudit_sdk_proxy") == "True" else False
+
+        headers = {"content-type": "application/json"}
+        original_file_size = content_dic["filesize"]  # 图片原始大小
+        target_file_size = (
+            int(get_param("wecom.msgaudit.chatdata_img_max_size")) * 1024
+        )  # 图片最大大小，超过此大小，进行压缩
+
+        body = {
+            "seq": 0,
+            "sdkfileid": content_dic["sdkfileid"],
+            "corpid": corpid,
+            "secret": secret,
+            "private_keys": key_list,
+            "target_file_size": target_file_size,
+            "original_file_size": original_file_size,
+            "msgtype": msgtype,
+        }
+        if proxy:
+            body.update(
+                {"proxy": mediadata_url, "paswd": "odoo:odoo",}
+            )
+        return mediadata_url, body, headers
+
+    def fetch_image_mediadatas(self, msg_records, max_workers):
+        """
+        并发获取多个图片消息的媒体文件
+        :param msg_records: 图片消息记录
+        :param max_workers: 最大线程数
+        :returns {记录ID: 响应的json 或 请求异常}
+        """
+        jobs = []
+        results = {}
+        for msg_record in msg_records:
+            try:
+                jobs.append(
+                    (
+                        msg_record.id,
+                        self.prepare_mediadata_request(
+                            msg_record.company_id, eval(msg_record.image)
+                        ),
+                    )
+                )
+            except Exception as e:
+                results[msg_record.id] = e
+        timeout = self.get_media_timeout()
+
+        def run(request):
+            try:
+                return request_mediadata(*request, timeout=timeout)
+            except Exception as e:
+                return e
+
+        if jobs:
+            requests_list = [request for __, request in jobs]
+            if max_workers <= 1 or len(jobs) <= 1:
+                responses = [run(request) for request in requests_list]
+            else:
+                with ThreadPoolExecutor(
+                    max_workers=min(max_workers, len(jobs))
+                ) as executor:
+                    responses = list(executor.map(run, requests_list))
+            results.update(zip([record_id for record_id, __ in jobs], responses))
+        return results
+
     def check_media_file_or_store(
         self, data_image, store=False, msgid=None, msgtype=None, msgtime=None
     ):